@@ -0,0 +1,160 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Optional, Protocol
+from metrics import GEMINI_TOKENS, record_upstream
+from work_scheduler import Priority, PrioritySemaphore, current_priority
+
+
+class LanguageModel(Protocol):
+    """
+    Giao diện tối thiểu của một model sinh văn bản (Gemini hoặc model giả lập khi test)
+    """
+
+    def generate(self, prompt: str) -> str:
+        ...
+
+
+class GeminiModel:
+    """
+    Adapter cho google.generativeai.GenerativeModel
+    """
+
+    # Số token lấy từ usage_metadata của response, engine không cần ước lượng
+    reports_usage = True
+
+    def __init__(self, model_name: str = "gemini-2.5-flash"):
+        import google.generativeai as genai
+        self._model = genai.GenerativeModel(model_name=model_name)
+
+    def generate(self, prompt: str) -> str:
+        response = self._model.generate_content(prompt)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            GEMINI_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+            GEMINI_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, kind="response")
+        return response.text
+
+
+def estimate_tokens(text: str) -> int:
+    # Xấp xỉ ~4 ký tự / token cho tiếng Anh
+    return max(1, len(text) // 4)
+
+
+def is_quota_error(exc: BaseException) -> bool:
+    """
+    Lỗi hết quota / bị giới hạn tốc độ (HTTP 429, ResourceExhausted) thì nên thử lại
+    """
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    if getattr(exc, "code", None) == 429 or getattr(exc, "status_code", None) == 429:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+class TokenBucket:
+    """
+    Token bucket tính theo phút. reserve() trừ trước (cho phép âm) và trả về
+    số giây cần chờ, nên các lời gọi được phục vụ theo thứ tự đến.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Giới hạn đồng thời số request/phút và số token/phút
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int):
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AnalysisEngine:
+    """
+    Gọi model với rate limit, số lời gọi đồng thời có giới hạn và retry
+    (backoff lũy thừa có jitter) khi gặp lỗi quota. Chỗ gọi model được cấp theo lớp ưu tiên
+    của công việc (current_priority), không ưu tiên thì coi như BULK.
+    """
+
+    def __init__(self, model: Optional[LanguageModel], max_concurrency: int = 4,
+                 requests_per_minute: float = 60, tokens_per_minute: float = 250_000,
+                 max_retries: int = 4, base_delay: float = 2.0, max_delay: float = 60.0,
+                 expected_output_tokens: int = 800):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_output_tokens = expected_output_tokens
+        self._semaphore: Optional[PrioritySemaphore] = None
+        self._loop = None
+
+    def _get_semaphore(self) -> PrioritySemaphore:
+        # Semaphore gắn với event loop, tạo lại nếu loop thay đổi (vd: mỗi lần asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = PrioritySemaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def _call_model(self, prompt: str) -> str:
+        start = time.perf_counter()
+        try:
+            text = self.model.generate(prompt)
+        except Exception as e:
+            record_upstream("gemini", "quota" if is_quota_error(e) else "error", time.perf_counter() - start)
+            raise
+        record_upstream("gemini", "ok", time.perf_counter() - start)
+        if not getattr(self.model, "reports_usage", False):
+            GEMINI_TOKENS.inc(estimate_tokens(prompt), kind="prompt")
+            GEMINI_TOKENS.inc(estimate_tokens(text or ""), kind="response")
+        return text
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def generate(self, prompt: str) -> str:
+        tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        priority = current_priority.get()
+        priority = Priority.BULK if priority is None else priority
+        attempt = 0
+        while True:
+            try:
+                async with self._get_semaphore().hold(priority):
+                    # Lấy chỗ trước rồi mới trừ quota: lời gọi ưu tiên cao không phải chờ
+                    # sau các lượt quota đã được lời gọi bulk đặt trước
+                    await self.limiter.acquire(tokens)
+                    return await asyncio.to_thread(self._call_model, prompt)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_quota_error(e):
+                    raise
+                delay = self._backoff(attempt)
+                print(f"⏳ Gemini quota error, retrying in {delay:.1f}s (attempt {attempt + 1}): {e}")
+                attempt += 1
+                await asyncio.sleep(delay)
@@ -0,0 +1,273 @@
+import re
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+PILLARS = ("environment", "social", "governance")
+
+_BOLD_NUMBER = re.compile(r"\*\*([^*\n]{0,60}\d[^*\n]{0,60})\*\*")
+_NUMBER = re.compile(r"(?:[$€£]\s?\d[\d,.]*\s?(?:billion|million|bn|m|k)?|\d[\d,.]*\s?(?:%|percent|billion|million|tonnes|tons|mw|gw))",
+                     re.IGNORECASE)
+_RECOMMENDATION = re.compile(
+    r"(?:Investment Recommendation|Final Recommendation|Recommended Action)\W*(Strong Buy|Strong Sell|Buy|Hold|Sell|Monitor|Avoid)",
+    re.IGNORECASE,
+)
+_PILLAR_LINE = re.compile(r"^\W*(Environmental|Social|Governance)\W*[:\-–]\s*(.*)$", re.IGNORECASE | re.MULTILINE)
+_NO_RISK = re.compile(r"^(none|n/?a|no (significant|direct|material|major)|not (applicable|relevant)|minimal|limited|low)\b",
+                      re.IGNORECASE)
+
+_POSITIVE = {"positive", "improve", "improved", "improvement", "opportunity", "opportunities", "growth", "strong",
+             "benefit", "reduce", "reduction", "renewable", "progress", "leadership", "innovation", "upgrade"}
+_NEGATIVE = {"negative", "risk", "risks", "lawsuit", "fine", "fines", "violation", "controversy", "scandal",
+             "decline", "loss", "losses", "breach", "penalty", "recall", "strike", "layoffs", "pollution", "spill",
+             "investigation", "downgrade", "concern", "concerns"}
+
+
+def _section(text: str, title: str) -> str:
+    """Lấy nội dung một mục (vd "ESG Risks:") tới tiêu đề mục kế tiếp"""
+    match = re.search(
+        rf"{title}[^\n:]*:(.*?)(?=\n\W*(?!Environmental|Social|Governance)[A-Z][A-Za-z &]{{2,40}}:|\Z)",
+        text, re.DOTALL,
+    )
+    return match.group(1) if match else ""
+
+
+def _risk_flags(text: str) -> Dict[str, bool]:
+    section = _section(text, "ESG Risk")
+    risks = dict.fromkeys(PILLARS, False)
+    lines = _PILLAR_LINE.findall(section)
+    for pillar, detail in lines:
+        detail = detail.strip().strip("*").strip()
+        if detail and not _NO_RISK.match(detail):
+            risks["environment" if pillar.lower() == "environmental" else pillar.lower()] = True
+    if not lines:
+        # Mục rủi ro viết dạng đoạn văn: câu nào nhắc tới trụ cột + "risk" mà không phủ định thì đánh dấu
+        for sentence in re.split(r"(?<=[.!?])\s+", section):
+            lowered = sentence.lower()
+            if "risk" not in lowered or re.search(r"\bno\b|\bnot\b", lowered):
+                continue
+            for pillar, word in zip(PILLARS, ("environmental", "social", "governance")):
+                if word in lowered:
+                    risks[pillar] = True
+    return risks
+
+
+def parse_analysis(text: str) -> Dict:
+    """
+    Tách một bài phân tích dạng markdown (theo FORMAT trong prompt) thành các trường có cấu trúc
+    """
+    relevant = "not relevant to" not in text.lower()[:300]
+    match = _RECOMMENDATION.search(text)
+    recommendation = match.group(1).title() if match else None
+
+    risks = _risk_flags(text)
+
+    words = re.findall(r"[a-z]+", text.lower())
+    positive = sum(w in _POSITIVE for w in words)
+    negative = sum(w in _NEGATIVE for w in words)
+    score = (positive - negative) / max(1, positive + negative)
+    sentiment = "positive" if score > 0.2 else "negative" if score < -0.2 else "neutral"
+
+    numbers = [n.strip() for n in _BOLD_NUMBER.findall(text)] or [n.strip() for n in _NUMBER.findall(text)]
+
+    return {
+        "relevant": relevant,
+        "recommendation": recommendation if relevant else None,
+        "environment_risk": risks["environment"],
+        "social_risk": risks["social"],
+        "governance_risk": risks["governance"],
+        "sentiment": sentiment,
+        "sentiment_score": round(score, 3),
+        "key_numbers": list(dict.fromkeys(numbers))[:10],
+    }
+
+
+class AnalysisStore:
+    """
+    Kho phân tích có cấu trúc: mỗi bài phân tích được parse một lần, ghi nối tiếp
+    (append-only) vào file NDJSON và giữ trong bộ nhớ dưới dạng các cột để lọc / xếp hạng
+    nhanh mà không cần gọi LLM.
+    Nhiều worker uvicorn ghi chung một file: trước mỗi truy vấn, các dòng mới (kể cả của
+    worker khác) được đọc tiếp từ vị trí đã đọc. Các phương thức đọc / ghi file là đồng bộ,
+    từ event loop thì gọi qua asyncio.to_thread.
+    """
+
+    COLUMNS = (
+        "company", "article_key", "title", "url", "published_at", "analyzed_at",
+        "relevant", "recommendation", "environment_risk", "social_risk", "governance_risk",
+        "sentiment", "sentiment_score", "key_numbers",
+    )
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.columns: Dict[str, list] = {name: [] for name in self.COLUMNS}
+        self._seen = set()
+        self._offset = 0  # số byte của file đã được đọc vào các cột
+        self._lock = threading.RLock()
+        if path:
+            self.sync()
+            print(f"✅ Loaded analysis store: {len(self)} analyses")
+
+    def __len__(self) -> int:
+        return len(self.columns["company"])
+
+    def sync(self):
+        """Đọc các dòng hoàn chỉnh được ghi thêm vào file kể từ lần đọc trước"""
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                print(f"⚠️ Failed to read analysis store: {e}")
+                return
+            # Dòng cuối có thể đang được worker khác ghi dở: để lần sau
+            end = data.rfind(b"\n") + 1
+            self._offset += end
+            for line in data[:end].splitlines():
+                line = line.strip()
+                if line:
+                    try:
+                        self._append_row(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def _append_row(self, row: Dict) -> bool:
+        key = (row.get("company"), row.get("article_key"))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        for name in self.COLUMNS:
+            self.columns[name].append(row.get(name))
+        return True
+
+    def add_many(self, company: str, items: List[tuple]) -> int:
+        """
+        items: các bộ (article, analysis, article_key) của cùng một công ty.
+        Ghi các bài mới bằng một lần append, trả về số bài được thêm.
+        """
+        rows = [
+            {
+                "company": company,
+                "article_key": key,
+                "title": article.get("title", ""),
+                "url": article.get("url", ""),
+                "published_at": article.get("publishedAt"),
+                "analyzed_at": time.time(),
+                **parse_analysis(analysis),
+            }
+            for article, analysis, key in items
+            if (company, key) not in self._seen and not analysis.startswith("Gemini Analysis Failed")
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            if not self.path:
+                return sum(self._append_row(row) for row in rows)
+            # Đọc hết phần worker khác đã ghi trước, rồi ghi và đọc lại cả phần của mình
+            self.sync()
+            rows = [row for row in rows if (company, row["article_key"]) not in self._seen]
+            if not rows:
+                return 0
+            before = len(self)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            except OSError as e:
+                print(f"⚠️ Failed to persist analysis: {e}")
+                return sum(self._append_row(row) for row in rows)
+            self.sync()
+            return len(self) - before
+
+    def add(self, company: str, article: Dict, analysis: str, article_key: str) -> bool:
+        return self.add_many(company, [(article, analysis, article_key)]) > 0
+
+    def _mask(self, companies: Optional[set] = None, recommendation: Optional[str] = None,
+              days: Optional[float] = None, sentiment: Optional[str] = None,
+              risk: Optional[str] = None) -> np.ndarray:
+        cols = self.columns
+        mask = np.array(cols["relevant"], dtype=bool)
+        if companies is not None:
+            mask &= np.fromiter((c in companies for c in cols["company"]), dtype=bool, count=len(self))
+        if recommendation:
+            mask &= np.array([(r or "").lower() == recommendation.lower() for r in cols["recommendation"]], dtype=bool)
+        if days is not None:
+            mask &= np.array(cols["analyzed_at"], dtype=float) >= time.time() - days * 86400
+        if sentiment:
+            mask &= np.array(cols["sentiment"], dtype=object) == sentiment.lower()
+        if risk:
+            mask &= np.array(cols[f"{risk.lower()}_risk"], dtype=bool)
+        return mask
+
+    def query(self, esg_store, industry: Optional[str] = None, recommendation: Optional[str] = None,
+              days: Optional[float] = None, sentiment: Optional[str] = None, risk: Optional[str] = None,
+              sort_by: str = "matching_articles", limit: int = 50) -> List[Dict]:
+        """
+        Lọc các bài phân tích rồi gộp theo công ty, ghép với điểm ESG trong data.csv.
+        Ví dụ: industry="Automobiles", recommendation="Sell", days=7
+        """
+        self.sync()
+        with self._lock:
+            return self._query(esg_store, industry, recommendation, days, sentiment, risk, sort_by, limit)
+
+    def _query(self, esg_store, industry, recommendation, days, sentiment, risk, sort_by, limit) -> List[Dict]:
+        if not len(self):
+            return []
+        companies = None
+        if industry:
+            companies = {r.name for r in esg_store if (r.industry or "").lower() == industry.lower()}
+        mask = self._mask(companies, recommendation, days, sentiment, risk)
+
+        results: Dict[str, Dict] = {}
+        cols = self.columns
+        for i in np.flatnonzero(mask):
+            company = cols["company"][i]
+            entry = results.get(company)
+            if entry is None:
+                record = esg_store.get(company)
+                entry = results[company] = {
+                    "company": company,
+                    "ticker": record.ticker if record else None,
+                    "industry": record.industry if record else None,
+                    "esg": record.esg_dict() if record else {},
+                    "matching_articles": 0,
+                    "recommendations": {},
+                    "risk_flags": dict.fromkeys(PILLARS, 0),
+                    "avg_sentiment": 0.0,
+                    "latest_analyzed_at": 0.0,
+                    "latest_recommendation": None,
+                    "articles": [],
+                }
+            entry["matching_articles"] += 1
+            rec = cols["recommendation"][i]
+            if rec:
+                entry["recommendations"][rec] = entry["recommendations"].get(rec, 0) + 1
+            for pillar in PILLARS:
+                entry["risk_flags"][pillar] += int(bool(cols[f"{pillar}_risk"][i]))
+            entry["avg_sentiment"] += cols["sentiment_score"][i]
+            if cols["analyzed_at"][i] >= entry["latest_analyzed_at"]:
+                entry["latest_analyzed_at"] = cols["analyzed_at"][i]
+                entry["latest_recommendation"] = rec
+            entry["articles"].append({
+                "title": cols["title"][i],
+                "url": cols["url"][i],
+                "recommendation": rec,
+                "sentiment": cols["sentiment"][i],
+                "key_numbers": cols["key_numbers"][i],
+            })
+
+        for entry in results.values():
+            entry["avg_sentiment"] = round(entry["avg_sentiment"] / entry["matching_articles"], 3)
+
+        def sort_key(entry):
+            if sort_by in ("environment_score", "social_score", "governance_score", "total_score"):
+                return entry["esg"].get(sort_by) or 0
+            return entry.get(sort_by) or 0
+
+        return sorted(results.values(), key=sort_key, reverse=True)[:limit]
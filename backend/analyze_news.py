@@ -1,16 +1,30 @@
 import os
-import time
 import re
-from typing import List
+import hashlib
+import asyncio
+from typing import List, Tuple
 from dotenv import load_dotenv
 import google.generativeai as genai
+from analysis_engine import AnalysisEngine, GeminiModel, estimate_tokens
+from cache import TTLCache
+from intent import question_cache_key
 
 # Load API key
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# Load model
-model = genai.GenerativeModel(model_name="gemini-2.5-flash")
+# Load model (engine.model có thể thay bằng model giả lập khi test / benchmark)
+engine = AnalysisEngine(
+    GeminiModel(model_name="gemini-2.5-flash"),
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    requests_per_minute=float(os.getenv("GEMINI_RPM", "60")),
+    tokens_per_minute=float(os.getenv("GEMINI_TPM", "250000")),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "4")),
+)
+
+# Số bài báo ngắn tối đa gộp vào một prompt (1 = tắt chế độ batch)
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "1"))
+GEMINI_BATCH_MAX_CHARS = int(os.getenv("GEMINI_BATCH_MAX_CHARS", "1500"))
 #Convert markdown response to plain text
 def markdown_to_plain_text(md_text: str) -> str:
     # Step 1: Remove ** (bold) by replacing **...** with ... (keep content)
@@ -28,7 +42,19 @@ def markdown_to_plain_text(md_text: str) -> str:
     return no_extra_blank_lines.strip()
 
 # --- 1. Extract keywords and analyze intent from question ---
-def extract_keywords_from_question_gemini(question: str) -> str:
+# Kết quả trích xuất của LLM được cache theo câu hỏi đã chuẩn hóa
+keyword_cache = TTLCache(
+    "keywords",
+    ttl=float(os.getenv("KEYWORD_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("KEYWORD_CACHE_MAX_ENTRIES", "4096")),
+)
+
+async def extract_keywords_from_question_gemini(question: str) -> str:
+    cache_key = question_cache_key(question)
+    cached = keyword_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     prompt = f"""
 You are an expert ESG analyst assistant.
 
@@ -47,23 +73,14 @@ Return your answer exactly in this format:
 Question: "{question}"
 """
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        response = (await engine.generate(prompt)).strip()
+        keyword_cache[cache_key] = response
+        return response
     except Exception as e:
         return f"Keyword Extraction Failed: {e}"
 
 # --- 2. Analyze a single ESG-related article ---
-def analyze_article(title: str, content: str, company: str) -> str:
-    prompt = f"""
-ESG Investment Article Analysis
-
-You are an experienced ESG analyst. Your task is to evaluate the following article with regard to the ESG profile of the specified company.
-
-Company: {company}  
-Article Title: {title}  
-Article Content: {content}
-
-== TASKS ==
+ARTICLE_TASKS = """== TASKS ==
 
 Step 1: Relevance Check  
 - If the article is NOT relevant to {company} (either directly or indirectly through industry context, supply chain, technology trends, or ESG policy landscape), reply only:  
@@ -96,25 +113,107 @@ Investment Recommendation:
 Justification:  
 """
 
+
+def _article_prompt(title: str, content: str, company: str) -> str:
+    return f"""
+ESG Investment Article Analysis
+
+You are an experienced ESG analyst. Your task is to evaluate the following article with regard to the ESG profile of the specified company.
+
+Company: {company}  
+Article Title: {title}  
+Article Content: {content}
+
+""" + ARTICLE_TASKS.format(company=company)
+
+
+def _batch_prompt(items: List[Tuple[str, str]], company: str) -> str:
+    articles = "\n".join(
+        f"### ARTICLE {i}\nArticle Title: {title}\nArticle Content: {content}\n"
+        for i, (title, content) in enumerate(items, start=1)
+    )
+    return f"""
+ESG Investment Article Analysis (batch)
+
+You are an experienced ESG analyst. Evaluate EACH of the following {len(items)} articles separately with regard to the ESG profile of the specified company.
+
+Company: {company}
+
+{articles}
+""" + ARTICLE_TASKS.format(company=company) + f"""
+== OUTPUT ==
+For each article, start its analysis with a line containing exactly "### ARTICLE <number>" (from 1 to {len(items)}), followed by the analysis in the FORMAT above.
+"""
+
+
+_BATCH_SPLIT = re.compile(r"^\s*#{0,3}\s*\**ARTICLE\s+(\d+)\**\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def _split_batch_response(text: str, count: int) -> List[str]:
+    parts = [None] * count
+    matches = list(_BATCH_SPLIT.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        index = int(match.group(1)) - 1
+        end = following.start() if following else len(text)
+        body = text[match.end():end].strip()
+        if 0 <= index < count and body:
+            parts[index] = body
+    return parts
+
+
+async def analyze_article(title: str, content: str, company: str) -> str:
     try:
-        response = model.generate_content(prompt)
-        time.sleep(1)  # rate limit buffer
-        return response.text if response.text else "No analysis returned."
+        response = await engine.generate(_article_prompt(title, content, company))
+        return response if response else "No analysis returned."
     except Exception as e:
         return f"Gemini Analysis Failed: {e}"
 
-# --- 3. Summarize multiple article analyses into one overall report ---
-def summarize_overall(company: str, analyses: List[str]) -> str:
-    if not analyses:
-        return f"No analyses available for {company}."
 
-    joined_analyses = "\n\n".join(analyses)
-    prompt = f"""
-ESG Investment Summary
+async def analyze_articles(items: List[Tuple[str, str]], company: str) -> List[str]:
+    """
+    Phân tích nhiều bài báo song song (giới hạn bởi engine).
+    Nếu bật batch, các bài ngắn được gộp vào một prompt rồi tách kết quả theo từng bài.
+    """
+    results: List[str] = [None] * len(items)
+    batchable = [i for i, (_, content) in enumerate(items) if len(content) <= GEMINI_BATCH_MAX_CHARS]
+    if GEMINI_BATCH_SIZE <= 1 or len(batchable) < 2:
+        batchable = []
+    groups = [batchable[i:i + GEMINI_BATCH_SIZE] for i in range(0, len(batchable), GEMINI_BATCH_SIZE)]
 
-You are reviewing multiple ESG article analyses for the company: {company}.
+    async def run_batch(group: List[int]):
+        if len(group) == 1:
+            return
+        try:
+            text = await engine.generate(_batch_prompt([items[i] for i in group], company))
+        except Exception as e:
+            print(f"⚠️ Batch analysis failed, falling back to single articles: {e}")
+            return
+        for i, part in zip(group, _split_batch_response(text or "", len(group))):
+            results[i] = part
+
+    await asyncio.gather(*(run_batch(group) for group in groups))
 
-=== Goals ===
+    # Bài không được batch (hoặc không tách được kết quả) thì phân tích riêng
+    missing = [i for i, result in enumerate(results) if result is None]
+    singles = await asyncio.gather(*(analyze_article(*items[i], company) for i in missing))
+    for i, analysis in zip(missing, singles):
+        results[i] = analysis
+    return results
+
+# --- 3. Summarize multiple article analyses into one overall report ---
+# Ngân sách token cho phần phân tích trong một prompt tóm tắt (vượt quá thì map-reduce)
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "8000"))
+# Số vòng reduce tối đa trước khi cắt bớt các bản tóm tắt trung gian
+SUMMARY_MAX_REDUCE_ROUNDS = int(os.getenv("SUMMARY_MAX_REDUCE_ROUNDS", "3"))
+
+# Bản tóm tắt theo công ty + tập hash các bài phân tích đã được tóm tắt
+summary_cache = TTLCache(
+    "summary",
+    ttl=float(os.getenv("SUMMARY_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "2048")),
+)
+
+SUMMARY_GOALS = """=== Goals ===
 1. Summarize the **overall ESG sentiment** (positive / neutral / negative).  
 2. Identify **recurring risks**, strengths, or themes from the articles.  
 3. Highlight any **notable data** (e.g., emissions stats, new regulations, supply chain issues).  
@@ -128,13 +227,122 @@ Key Data Highlights:
 Final Recommendation:  
 Justification:  
 """
+
+
+def _summary_prompt(company: str, joined_analyses: str) -> str:
+    return f"""
+ESG Investment Summary
+
+You are reviewing multiple ESG article analyses for the company: {company}.
+
+""" + SUMMARY_GOALS + f"""
+=== Article Analyses ===
+{joined_analyses}
+"""
+
+
+def _partial_summary_prompt(company: str, joined_analyses: str) -> str:
+    return f"""
+ESG Investment Summary (partial)
+
+You are condensing a subset of ESG article analyses for the company: {company}.
+Write a compact intermediate summary that keeps the ESG sentiment, recurring risks and strengths,
+key numbers and each article's investment recommendation. It will be merged with other partial summaries.
+
+=== Article Analyses ===
+{joined_analyses}
+"""
+
+
+def _update_summary_prompt(company: str, summary: str, joined_analyses: str) -> str:
+    return f"""
+ESG Investment Summary (update)
+
+You previously wrote the ESG summary below for the company: {company}.
+New article analyses have arrived. Update the summary to reflect them: revise the sentiment,
+risks, data highlights and recommendation only where the new information changes them.
+
+""" + SUMMARY_GOALS + f"""
+=== Existing Summary ===
+{summary}
+
+=== New Article Analyses ===
+{joined_analyses}
+"""
+
+
+def _analysis_hash(analysis: str) -> str:
+    return hashlib.sha1(analysis.encode("utf-8")).hexdigest()
+
+
+def _chunk_by_budget(texts: List[str], budget: int) -> List[List[str]]:
+    chunks, current, used = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if tokens > budget:
+            # Một bài phân tích quá dài thì cắt bớt cho vừa ngân sách
+            text = text[:budget * 4]
+            tokens = budget
+        if current and used + tokens > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _reduce_to_budget(company: str, texts: List[str], budget: int) -> List[str]:
+    # Map-reduce: tóm tắt từng nhóm vừa ngân sách cho đến khi toàn bộ vừa một prompt
+    chunks = _chunk_by_budget(texts, budget)
+    rounds = 0
+    while len(chunks) > 1:
+        partials = await asyncio.gather(*(
+            engine.generate(_partial_summary_prompt(company, "\n\n".join(chunk))) for chunk in chunks
+        ))
+        reduced = _chunk_by_budget([p for p in partials if p], budget)
+        rounds += 1
+        if len(reduced) > 1 and (len(reduced) >= len(chunks) or rounds >= SUMMARY_MAX_REDUCE_ROUNDS):
+            # Bản tóm tắt trung gian không ngắn đi (hoặc đã hết số vòng): cắt đều để vừa một prompt,
+            # tránh lặp vô hạn lời gọi Gemini
+            texts = [text for chunk in reduced for text in chunk]
+            per_text = max(1, budget // len(texts)) * 4
+            return [text[:per_text] for text in texts]
+        chunks = reduced
+    return chunks[0] if chunks else []
+
+
+async def summarize_overall(company: str, analyses: List[str]) -> str:
+    if not analyses:
+        return f"No analyses available for {company}."
+
+    hashes = [_analysis_hash(a) for a in analyses]
+    cached = summary_cache.get(company)
     try:
-        response = model.generate_content(prompt)
-        return response.text if response.text else "No summary generated."
+        if cached is not None:
+            summary, covered = cached
+            new_analyses = [a for a, h in zip(analyses, hashes) if h not in covered]
+            if not new_analyses:
+                return summary
+            # Chỉ gửi phần chênh lệch cùng bản tóm tắt cũ, không tóm tắt lại từ đầu
+            # (bản tóm tắt cũ quá dài thì vẫn giữ ít nhất nửa ngân sách cho phần mới)
+            budget = max(SUMMARY_TOKEN_BUDGET // 2, SUMMARY_TOKEN_BUDGET - estimate_tokens(summary))
+            joined = "\n\n".join(await _reduce_to_budget(company, new_analyses, budget))
+            response = await engine.generate(_update_summary_prompt(company, summary, joined))
+            covered = covered | set(hashes)
+        else:
+            joined = "\n\n".join(await _reduce_to_budget(company, analyses, SUMMARY_TOKEN_BUDGET))
+            response = await engine.generate(_summary_prompt(company, joined))
+            covered = frozenset(hashes)
+        if not response:
+            return "No summary generated."
+        summary_cache[company] = (response, frozenset(covered))
+        return response
     except Exception as e:
         return f"Summary generation failed: {e}"
 
-def analyze_question_semantically(question: str) -> str:
+async def analyze_question_semantically(question: str) -> str:
     prompt = f"""
 You are an intelligent ESG assistant.
 
@@ -148,8 +356,8 @@ Please analyze the following user question and return:
 Question: "{question}"
 """
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        response = await engine.generate(prompt)
+        return response.strip()
     except Exception as e:
         return f"⚠️ Semantic Parsing Failed: {e}"
 
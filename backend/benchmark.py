@@ -0,0 +1,374 @@
+"""
+Benchmark tải cho backend, chạy hoàn toàn cục bộ (không gọi NewsAPI / Gemini thật):
+- FakeNewsAPI: server HTTP cục bộ trả bài báo giả (có bản sao syndicated), độ trễ,
+  tỉ lệ lỗi và tỉ lệ 429 cấu hình được
+- FakeGeminiModel: model giả lập cắm vào analyze_news.engine, có độ trễ / lỗi / lỗi quota
+
+Ví dụ:
+    python benchmark.py --scenarios analyze,ask --requests 50 --concurrency 10
+    python benchmark.py --scenarios default --default-limit 100 --gemini-latency 0.5 --json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from typing import Dict, List, Optional
+
+
+class FakeNewsAPI:
+    """Server NewsAPI giả lập chạy bằng uvicorn trong một thread riêng"""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 articles: int = 5, syndication: float = 0.4, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.articles = articles
+        self.syndication = syndication
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.port = self._free_port()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v2/everything"
+
+    def _payload(self, query: str, limit: int) -> Dict:
+        rng = random.Random(query)
+        wire = (f"{query} announced new targets to cut greenhouse gas emissions across its operations by 2030, "
+                f"including investments in renewable energy, supply chain audits and a review of board oversight "
+                f"of climate risk, according to people familiar with the matter")
+        articles = []
+        for i in range(min(limit, self.articles)):
+            if rng.random() < self.syndication:
+                # Bản sao của cùng một tin (syndicated) với chỉnh sửa nhỏ, khác URL / nguồn
+                content = wire.replace("according to", rng.choice(["according to", "said", "reported by"]))
+                title = f"{query} sets 2030 emissions goal"
+            else:
+                topic = rng.choice(["labor dispute", "data privacy fine", "board shake-up", "water usage",
+                                    "supplier audit", "diversity report", "product recall", "solar investment"])
+                content = f"{query} faces scrutiny over {topic} #{i}: analysts expect the issue to weigh on " \
+                          f"its ESG rating as regulators and investors ask for more disclosure on {topic}."
+                title = f"{query}: {topic} in focus"
+            articles.append({
+                "source": {"name": f"Source {i}"},
+                "title": title,
+                "url": f"https://news.example.com/{abs(hash((query, i)))}",
+                "content": content + f" [+{rng.randint(500, 5000)} chars]",
+                "description": content[:120],
+                "publishedAt": "2025-07-16T12:00:00Z",
+            })
+        return {"status": "ok", "totalResults": len(articles), "articles": articles}
+
+    def _app(self):
+        from fastapi import FastAPI, Query
+        from fastapi.responses import JSONResponse
+
+        app = FastAPI()
+
+        @app.get("/v2/everything")
+        async def everything(q: str = "", pageSize: int = Query(10)):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return JSONResponse({"status": "error", "code": "rateLimited"}, status_code=429)
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return JSONResponse({"status": "error", "code": "unexpectedError"}, status_code=500)
+            return self._payload(q, pageSize)
+
+        return app
+
+    def start(self):
+        import uvicorn
+        config = uvicorn.Config(self._app(), host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started and time.time() < deadline:
+            time.sleep(0.02)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+
+class QuotaExceeded(Exception):
+    """Giả lập lỗi 429 ResourceExhausted của Gemini"""
+
+
+class FakeGeminiModel:
+    """Model giả lập theo giao diện LanguageModel của analysis_engine"""
+
+    def __init__(self, latency: float = 0.2, error_rate: float = 0.0, quota_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def generate(self, prompt: str) -> str:
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += len(prompt) // 4
+            roll = self.random.random()
+        time.sleep(self.latency)
+        if roll < self.quota_rate:
+            with self.lock:
+                self.quota_errors += 1
+            raise QuotaExceeded("429 Resource has been exhausted (e.g. check quota).")
+        if roll < self.quota_rate + self.error_rate:
+            with self.lock:
+                self.errors += 1
+            raise RuntimeError("500 Internal error")
+        text = self._respond(prompt)
+        with self.lock:
+            self.output_tokens += len(text) // 4
+        return text
+
+    def _respond(self, prompt: str) -> str:
+        if "Extract the company names" in prompt:
+            question = re.search(r'Question: "(.*)"', prompt)
+            words = re.findall(r"[a-z]{4,}", (question.group(1) if question else "").lower())
+            return f"- Companies: \n- Keywords: {', '.join(words[:3]) or 'esg'}\n- Intent: ESG concern"
+        analysis = (
+            "Summary: The article discusses ESG developments.\n"
+            "ESG Highlights: **30% emissions cut** by 2030\n"
+            "Company Relevance: Direct.\n"
+            "ESG Risks:\n- Environmental: transition risk from emissions targets\n- Social: none\n"
+            "- Governance: board oversight questions\n"
+            "Opportunities: renewable energy investment\n"
+            "Strategic Impact: moderate\n"
+            f"Investment Recommendation: {self.random.choice(['Buy', 'Hold', 'Sell'])}\n"
+            "Justification: balanced ESG profile."
+        )
+        batch = re.findall(r"^### ARTICLE (\d+)$", prompt, re.MULTILINE)
+        if batch:
+            return "\n".join(f"### ARTICLE {n}\n{analysis}" for n in batch)
+        if "ESG Investment Summary" in prompt:
+            return ("Overall Sentiment: neutral\nCommon ESG Risks & Strengths: emissions, governance\n"
+                    "Key Data Highlights: 30% cut\nFinal Recommendation: Hold\nJustification: mixed signals.")
+        return analysis
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def reset_state(main, analyze_news, fingerprint):
+    """Xóa toàn bộ cache (kể cả kho dùng chung) để mỗi kịch bản chạy ở trạng thái lạnh"""
+    from shared_store import SharedStore
+    for cache in (main.news_cache, main.analysis_cache, main.article_cache,
+                  analyze_news.summary_cache, analyze_news.keyword_cache):
+        cache.clear()
+    if main.shared_store is not None:
+        path = main.shared_store.path
+        main.shared_store.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        main.shared_store = SharedStore(path)
+    main.fingerprint_index = fingerprint.FingerprintIndex(
+        max_entries=main.article_cache.max_entries, threshold=main.NEAR_DUPLICATE_THRESHOLD,
+    )
+
+
+async def run_scenario(name: str, make_request, total: int, concurrency: int, client) -> Dict:
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            method, path, kwargs = make_request(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def build_requests(companies: List[str], per_request: int, seed: int):
+    rng = random.Random(seed)
+    questions = [
+        "Should I invest in {a}?",
+        "What are the ESG risks of {a}?",
+        "{a} vs {b}, which is better for ESG?",
+        "Is lithium mining harmful to water supplies?",
+        "How do supply chain audits affect labor rights in electronics?",
+    ]
+
+    def analyze(_):
+        return "POST", "/api/analyze_companies", {"json": {"companies": rng.sample(companies, per_request)}}
+
+    def ask(_):
+        a, b = rng.sample(companies, 2)
+        return "POST", "/api/ask", {"json": {"question": rng.choice(questions).format(a=a, b=b)}}
+
+    def default(_):
+        return "GET", "/api/analyze_default_companies", {}
+
+    return {"analyze": analyze, "ask": ask, "default": default}
+
+
+async def main_async(args) -> List[Dict]:
+    import httpx
+
+    news = FakeNewsAPI(args.news_latency, args.news_error_rate, args.news_rate_limit_rate,
+                       args.articles, args.syndication, args.seed)
+    news.start()
+    os.environ["NEWSAPI_URL"] = news.url
+
+    import main
+    import analyze_news
+    import fingerprint
+
+    model = FakeGeminiModel(args.gemini_latency, args.gemini_error_rate, args.gemini_quota_rate, args.seed)
+    analyze_news.engine.model = model
+    analyze_news.engine.base_delay = 0.05
+    analyze_news.GEMINI_BATCH_SIZE = args.batch_size
+
+    companies = main.load_company_list()
+    default_companies = companies[:args.default_limit]
+    main.load_company_list = lambda: list(default_companies)
+    makers = build_requests(companies, args.companies_per_request, args.seed)
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for scenario in args.scenarios.split(","):
+            scenario = scenario.strip()
+            if scenario not in makers:
+                raise SystemExit(f"Unknown scenario: {scenario}")
+            if not args.warm:
+                reset_state(main, analyze_news, fingerprint)
+            news_before = (news.calls, news.errors, news.rate_limited)
+            model_before = (model.calls, model.quota_errors, model.prompt_tokens, model.output_tokens)
+            if args.trace_memory:
+                tracemalloc.start()
+
+            total = args.default_requests if scenario == "default" else args.requests
+            result = await run_scenario(scenario, makers[scenario], total, args.concurrency, client)
+
+            if args.trace_memory:
+                result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+                tracemalloc.stop()
+            result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+            result["newsapi_calls"] = news.calls - news_before[0]
+            result["newsapi_errors"] = (news.errors - news_before[1]) + (news.rate_limited - news_before[2])
+            result["gemini_calls"] = model.calls - model_before[0]
+            result["gemini_quota_errors"] = model.quota_errors - model_before[1]
+            result["gemini_prompt_tokens"] = model.prompt_tokens - model_before[2]
+            result["gemini_output_tokens"] = model.output_tokens - model_before[3]
+            results.append(result)
+
+    await main.news_client.aclose()
+    news.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hermetic load benchmark for the ESG backend")
+    parser.add_argument("--scenarios", default="analyze,ask,default")
+    parser.add_argument("--requests", type=int, default=50, help="requests per analyze/ask scenario")
+    parser.add_argument("--default-requests", type=int, default=1, help="requests for the default scenario")
+    parser.add_argument("--default-limit", type=int, default=50, help="companies served by the default list")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--companies-per-request", type=int, default=3)
+    parser.add_argument("--warm", action="store_true", help="keep caches between scenarios")
+    parser.add_argument("--news-latency", type=float, default=0.05)
+    parser.add_argument("--news-error-rate", type=float, default=0.0)
+    parser.add_argument("--news-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--articles", type=int, default=5)
+    parser.add_argument("--syndication", type=float, default=0.4, help="share of syndicated duplicate articles")
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-quota-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="measure peak Python allocations (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    # Giới hạn quota cao và file trạng thái tạm để benchmark không ảnh hưởng dữ liệu thật
+    workdir = tempfile.mkdtemp(prefix="esg-bench-")
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["ANALYSIS_STORE_PATH"] = os.path.join(workdir, "analysis_store.ndjson")
+    os.environ["PRECOMPUTE_CHECKPOINT"] = os.path.join(workdir, "precompute_state.json")
+    os.environ["PRECOMPUTE_ENABLED"] = "false"
+    os.environ["SHARED_STORE_PATH"] = os.path.join(workdir, "shared_store.db")
+    os.environ["SHARED_STORE_WARM_FILES"] = ""
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+
+    results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = ["scenario", "requests", "concurrency", "throughput_rps", "p50_s", "p95_s", "p99_s",
+               "newsapi_calls", "gemini_calls", "gemini_prompt_tokens", "peak_rss_mb"]
+    if args.trace_memory:
+        columns.append("peak_traced_mb")
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result.get(c)) for c in columns))
+        print(f"   statuses={result['statuses']} newsapi_errors={result['newsapi_errors']} "
+              f"gemini_quota_errors={result['gemini_quota_errors']}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,153 @@
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Ước lượng số byte bộ nhớ của một giá trị (đủ chính xác để giới hạn cache)
+    """
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def company_scope(company: str) -> str:
+    """
+    Tên công ty (hoặc keyword) dạng chuẩn dùng làm phạm vi cho kết quả phân tích bài báo
+    """
+    return " ".join(company.lower().split())
+
+
+def article_key(url: str, content: str, company: str) -> str:
+    """
+    Khóa cache cho phân tích một bài báo: hash của công ty + URL + nội dung.
+    Prompt phân tích phụ thuộc công ty (kiểm tra liên quan, khuyến nghị) nên không dùng chung giữa các công ty.
+    """
+    return hashlib.sha256(f"{company_scope(company)}\n{url}\n{content}".encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """
+    Cache LRU có giới hạn số phần tử, giới hạn bộ nhớ (ước lượng) và thời gian sống (TTL)
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = 1024, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = estimate_size):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self.current_bytes += size
+            self._evict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __getitem__(self, key: Hashable) -> Any:
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self.current_bytes -= size
+
+    def _over_limit(self) -> bool:
+        return len(self._data) > self.max_entries or (
+            self.max_bytes is not None and self.current_bytes > self.max_bytes
+        )
+
+    def _evict(self):
+        # Chỉ bỏ các phần tử hết hạn ở đầu LRU (không quét toàn bộ cache trong lock),
+        # phần tử hết hạn nằm giữa sẽ bị bỏ khi được đọc hoặc khi trôi về đầu
+        now = time.monotonic()
+        while self._data:
+            oldest = next(iter(self._data))
+            if self._data[oldest][1] > now:
+                break
+            self._remove(oldest)
+            self.expirations += 1
+        # Sau đó bỏ phần tử ít dùng nhất (đầu OrderedDict) cho tới khi dưới giới hạn
+        while self._data and self._over_limit():
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
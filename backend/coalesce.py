@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class Coalescer:
+    """
+    Gộp các lời gọi trùng key đang chạy thành một task chung do Coalescer sở hữu:
+    - mọi request (kể cả request khởi tạo) chỉ chờ task chung qua asyncio.shield,
+      nên một request bị hủy không làm hủy / lỗi các request khác
+    - task chung chỉ bị hủy khi không còn request nào chờ kết quả
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, List] = {}  # key -> [task, số request đang chờ]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def _discard(self, key: Hashable, entry: List):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._discard(key, entry))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                # Request cuối cùng đã bỏ đi: dừng task chung để không tốn quota vô ích
+                self._discard(key, entry)
+                task.cancel()
@@ -0,0 +1,123 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from rapidfuzz import fuzz, process
+
+# Hậu tố pháp lý bị bỏ khi chuẩn hóa tên công ty
+COMPANY_SUFFIXES = {
+    "inc", "incorporated", "co", "corp", "corporation", "company", "cos",
+    "ltd", "limited", "plc", "llc", "lp", "sa", "ag", "nv", "the",
+}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9&]+")
+
+
+def normalize_company_name(name: str) -> str:
+    """
+    Chuẩn hóa tên công ty: chữ thường, bỏ dấu câu và các hậu tố như Inc, Co, Corp
+    """
+    tokens = _NON_ALNUM.sub(" ", name.lower()).split()
+    stripped = [t for t in tokens if t not in COMPANY_SUFFIXES]
+    # Giữ nguyên nếu tên chỉ gồm hậu tố (vd: "The Company")
+    return " ".join(stripped or tokens)
+
+
+class CompanyMatch(NamedTuple):
+    query: str
+    name: Optional[str]
+    score: float
+    method: str  # "ticker" | "alias" | "fuzzy" | "none"
+
+
+class CompanyResolver:
+    """
+    Bộ chỉ mục tên công ty dựng một lần khi khởi động:
+    - tra cứu ticker / alias chính xác trong O(1)
+    - fallback fuzzy matching theo lô bằng rapidfuzz.process.cdist
+    """
+
+    def __init__(self, names: Iterable[str], tickers: Iterable[str] = (), threshold: float = 75):
+        self.names: List[str] = list(names)
+        self.threshold = threshold
+        self._by_ticker: Dict[str, str] = {}
+        self._by_alias: Dict[str, str] = {}
+
+        for name, ticker in zip(self.names, list(tickers) or [None] * len(self.names)):
+            if ticker:
+                self._by_ticker.setdefault(str(ticker).upper(), name)
+            self.add_alias(name, name)
+            self.add_alias(normalize_company_name(name), name)
+
+        # Fuzzy matching so với tên đầy đủ: tên đã bỏ hậu tố quá ngắn ("ppl", "waters")
+        # khiến WRatio chấm điểm partial cao cho các từ khóa chung như "supply chain"
+        self._choices = self.names
+        # Tên đã chuẩn hóa dùng cho so khớp chặt (match_names)
+        self._normalized = [normalize_company_name(n) for n in self.names]
+
+    def add_alias(self, alias: str, name: str):
+        key = " ".join(alias.lower().split())
+        if key:
+            self._by_alias.setdefault(key, name)
+
+    def _exact(self, query: str) -> Optional[CompanyMatch]:
+        stripped = query.strip()
+        # Chỉ coi là ticker khi viết hoa hoặc có tiền tố $ (tránh "key", "all", "now" khớp nhầm)
+        if stripped.startswith("$") or (stripped.isupper() and len(stripped) <= 6):
+            name = self._by_ticker.get(stripped.lstrip("$").upper())
+            if name:
+                return CompanyMatch(query, name, 100.0, "ticker")
+        name = self._by_alias.get(" ".join(stripped.lower().split())) or \
+            self._by_alias.get(normalize_company_name(stripped))
+        if name:
+            return CompanyMatch(query, name, 100.0, "alias")
+        return None
+
+    def resolve_many(self, queries: List[str], fuzzy: bool = True) -> List[CompanyMatch]:
+        """
+        fuzzy=False chỉ nhận ticker / alias chính xác (dùng cho keyword, không phải tên công ty)
+        """
+        results: List[Optional[CompanyMatch]] = [None] * len(queries)
+        pending = []
+        for i, query in enumerate(queries):
+            if not query or not query.strip():
+                results[i] = CompanyMatch(query, None, 0.0, "none")
+                continue
+            results[i] = self._exact(query)
+            if results[i] is None:
+                pending.append(i)
+
+        if pending and fuzzy and self._choices:
+            scores = process.cdist([queries[i] for i in pending], self._choices, scorer=fuzz.WRatio, workers=-1)
+            best = scores.argmax(axis=1)
+            for row, i in enumerate(pending):
+                col = int(best[row])
+                score = float(scores[row, col])
+                name = self.names[col] if score >= self.threshold else None
+                results[i] = CompanyMatch(queries[i], name, score, "fuzzy" if name else "none")
+        else:
+            for i in pending:
+                results[i] = CompanyMatch(queries[i], None, 0.0, "none")
+        return results
+
+    def match_names(self, queries: List[str], threshold: float = 90) -> List[CompanyMatch]:
+        """
+        Khớp chặt cho danh sách tên do người dùng nhập (vd /api/compare): chỉ nhận alias chính xác
+        hoặc tên gần đúng cả chuỗi (fuzz.ratio trên tên đã chuẩn hóa >= threshold), không nhận khớp một phần
+        """
+        results = self.resolve_many(queries, fuzzy=False)
+        pending = [i for i, match in enumerate(results) if match.name is None and queries[i].strip()]
+        if pending and self._normalized:
+            normalized = [normalize_company_name(queries[i]) for i in pending]
+            scores = process.cdist(normalized, self._normalized, scorer=fuzz.ratio, workers=-1)
+            best = scores.argmax(axis=1)
+            for row, i in enumerate(pending):
+                col = int(best[row])
+                score = float(scores[row, col])
+                name = self.names[col] if score >= threshold else None
+                results[i] = CompanyMatch(queries[i], name, score, "fuzzy" if name else "none")
+        return results
+
+    def resolve(self, query: str) -> CompanyMatch:
+        return self.resolve_many([query])[0]
+
+    def best_match(self, query: str) -> Optional[str]:
+        return self.resolve(query).name
@@ -0,0 +1,139 @@
+import os
+import csv
+import pickle
+from typing import Dict, Iterator, List, Optional
+
+CACHE_VERSION = 1
+SCORE_FIELDS = ("environment_score", "social_score", "governance_score", "total_score")
+
+
+class EsgRecord:
+    """
+    Một dòng dữ liệu ESG của data.csv (dùng __slots__ để tiết kiệm bộ nhớ)
+    """
+    __slots__ = (
+        "ticker", "name", "currency", "exchange", "industry", "logo", "weburl",
+        "environment_grade", "environment_level", "social_grade", "social_level",
+        "governance_grade", "governance_level",
+        "environment_score", "social_score", "governance_score", "total_score",
+        "last_processing_date", "total_grade", "total_level", "cik",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def esg_dict(self) -> Dict:
+        return {
+            "environment_score": self.environment_score,
+            "social_score": self.social_score,
+            "governance_score": self.governance_score,
+            "total_score": self.total_score,
+            "environment_grade": self.environment_grade,
+            "social_grade": self.social_grade,
+            "governance_grade": self.governance_grade,
+            "total_grade": self.total_grade,
+        }
+
+
+def _parse_score(value: str) -> Optional[int]:
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def _parse_text(value: str) -> Optional[str]:
+    value = (value or "").strip()
+    return value or None
+
+
+def _read_csv(path: str) -> List[tuple]:
+    rows = []
+    # Dùng chung object cho các chuỗi lặp lại (sàn, ngành, hạng...) để giảm bộ nhớ và kích thước file cache
+    interned: Dict[str, str] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for raw in csv.DictReader(f):
+            values = []
+            for field in EsgRecord.__slots__:
+                if field in SCORE_FIELDS:
+                    values.append(_parse_score(raw.get(field)))
+                elif field == "ticker":
+                    values.append((raw.get(field) or "").strip().upper())
+                else:
+                    text = _parse_text(raw.get(field))
+                    values.append(interned.setdefault(text, text) if text else text)
+            rows.append(tuple(values))
+    return rows
+
+
+class EsgStore:
+    """
+    Bảng điểm ESG đánh chỉ mục theo ticker và tên chuẩn.
+    Dữ liệu được lưu dạng nhị phân cạnh data.csv và chỉ dựng lại khi CSV thay đổi.
+    """
+
+    def __init__(self, records: List[EsgRecord]):
+        self.records = records
+        self._by_name: Dict[str, EsgRecord] = {}
+        self._by_ticker: Dict[str, EsgRecord] = {}
+        for record in records:
+            if record.name:
+                self._by_name.setdefault(record.name, record)
+            if record.ticker:
+                self._by_ticker.setdefault(record.ticker, record)
+
+    @classmethod
+    def load(cls, csv_path: str, cache_path: Optional[str] = None) -> "EsgStore":
+        cache_path = cache_path or csv_path + ".cache"
+        stat = os.stat(csv_path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+
+        rows = None
+        try:
+            with open(cache_path, "rb") as f:
+                payload = pickle.load(f)
+            if payload.get("version") == CACHE_VERSION and payload.get("fingerprint") == fingerprint:
+                rows = payload["rows"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            rows = None
+
+        if rows is None:
+            rows = _read_csv(csv_path)
+            payload = {"version": CACHE_VERSION, "fingerprint": fingerprint, "rows": rows}
+            tmp_path = cache_path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"⚠️ Could not write ESG cache file '{cache_path}': {e}")
+
+        return cls([EsgRecord(*row) for row in rows])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[EsgRecord]:
+        return iter(self.records)
+
+    @property
+    def names(self) -> List[str]:
+        return [r.name for r in self.records]
+
+    @property
+    def tickers(self) -> List[str]:
+        return [r.ticker for r in self.records]
+
+    def get(self, name: str) -> Optional[EsgRecord]:
+        return self._by_name.get(name)
+
+    def get_by_ticker(self, ticker: str) -> Optional[EsgRecord]:
+        return self._by_ticker.get(ticker.upper())
+
+    def esg_dict(self, name: str) -> Dict:
+        record = self.get(name)
+        return record.esg_dict() if record else {}
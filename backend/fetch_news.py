@@ -1,36 +1,116 @@
 import os
-import requests
-from typing import List, Dict
+import asyncio
+import time
+import httpx
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
+from metrics import record_upstream
+from coalesce import Coalescer
 
 load_dotenv()
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")
+NEWSAPI_URL = os.getenv("NEWSAPI_URL", "https://newsapi.org/v2/everything")
+NEWSAPI_TIMEOUT = float(os.getenv("NEWSAPI_TIMEOUT", "10"))
+NEWSAPI_MAX_CONCURRENCY = int(os.getenv("NEWSAPI_MAX_CONCURRENCY", "8"))
 
-def fetch_news(query: str, limit: int = 10) -> List[Dict]:
+
+class NewsFetchError(Exception):
+    """NewsAPI lỗi (HTTP lỗi, 429, timeout) - khác với truy vấn không có bài báo nào"""
+
+
+def _build_params(query: str, limit: int) -> Dict:
+    return {
+        "q": query,
+        "language": "en",
+        "pageSize": limit,
+        "sortBy": "relevancy",
+        "apiKey": NEWSAPI_KEY,
+    }
+
+
+def _parse_articles(data: Dict) -> List[Dict]:
+    articles = data.get("articles", [])
+    if not articles:
+        return []
+    return [
+        {
+            "title": article["title"],
+            "url": article["url"],
+            "source": article["source"]["name"],
+            "content": article.get("content") or article.get("description", ""),
+            "publishedAt": article.get("publishedAt")
+        }
+        for article in articles
+    ]
+
+
+class NewsClient:
+    """
+    Client bất đồng bộ cho NewsAPI:
+    - dùng chung một connection pool (httpx.AsyncClient)
+    - giới hạn số request đồng thời
+    - gộp các request trùng (query, limit) đang chạy thành một lời gọi duy nhất
+    """
+
+    def __init__(self, max_concurrency: int = NEWSAPI_MAX_CONCURRENCY, timeout: float = NEWSAPI_TIMEOUT,
+                 url: str = NEWSAPI_URL, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight = Coalescer()
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            )
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits, transport=self._transport)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def fetch(self, query: str, limit: int = 10) -> List[Dict]:
+        key = (query, limit)
+        if key in self._inflight:
+            self.coalesced_calls += 1
+        return await self._inflight.run(key, lambda: self._fetch_upstream(query, limit))
+
+    async def _fetch_upstream(self, query: str, limit: int) -> List[Dict]:
+        client = self._get_client()
+        async with self._semaphore:
+            self.upstream_calls += 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(self.url, params=_build_params(query, limit))
+                response.raise_for_status()
+                articles = _parse_articles(response.json())
+            except httpx.HTTPError as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                record_upstream("newsapi", "rate_limited" if status == 429 else "error", time.perf_counter() - start)
+                # Không đưa URL vào thông báo lỗi (có apiKey), thông báo này hiện ở /api/precompute/status
+                reason = f"HTTP {status}" if status else type(e).__name__
+                print(f"⚠️ News fetch failed for query '{query}': {reason}")
+                raise NewsFetchError(f"News fetch failed for query '{query}': {reason}") from e
+            record_upstream("newsapi", "ok", time.perf_counter() - start)
+            return articles
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+news_client = NewsClient()
+
+
+async def fetch_news_async(query: str, limit: int = 10) -> List[Dict]:
     """
-    Truy vấn bài báo liên quan đến query từ NewsAPI
+    Truy vấn bài báo liên quan đến query từ NewsAPI, dùng client chung news_client.
+    Ném NewsFetchError khi NewsAPI lỗi, để nơi gọi không nhầm với "không có bài báo"
     """
-    url = (
-        f"https://newsapi.org/v2/everything"
-        f"?q={query}&language=en&pageSize={limit}&sortBy=relevancy&apiKey={NEWSAPI_KEY}"
-    )
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        articles = data.get("articles", [])
-        if not articles:
-            return []
-        return [
-            {
-                "title": article["title"],
-                "url": article["url"],
-                "source": article["source"]["name"],
-                "content": article.get("content") or article.get("description", ""),
-                "publishedAt": article.get("publishedAt")
-            }
-            for article in articles
-        ]
-    except requests.RequestException as e:
-        print(f"⚠️ News fetch failed for query '{query}': {e}")
-        return []
\ No newline at end of file
+    return await news_client.fetch(query, limit)
@@ -0,0 +1,123 @@
+import re
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# NewsAPI cắt nội dung và thêm hậu tố kiểu "… [+2345 chars]"
+_TRUNCATION = re.compile(r"\[\+\d+ chars\]")
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+
+# Họ hàm băm h_i(x) = (x XOR seed_i) * odd_i (mod 2^64), sinh cố định để chữ ký ổn định giữa các lần chạy
+_rng = np.random.default_rng(20240717)
+_SEEDS = _rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+_MULTIPLIERS = _rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+
+
+def _shingles(text: str, size: int = 2) -> set:
+    tokens = _TOKEN.findall(_TRUNCATION.sub(" ", text.lower()))
+    if len(tokens) < size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """
+    Chữ ký MinHash trên các shingle 2 từ: tỉ lệ phần tử trùng nhau giữa hai chữ ký
+    xấp xỉ độ tương đồng Jaccard của hai văn bản
+    """
+    shingles = _shingles(text)
+    if not shingles:
+        return None
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    # Phép nhân uint64 tràn số (mod 2^64) là có chủ đích
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, None] ^ _SEEDS) * _MULTIPLIERS
+    return (permuted.min(axis=0) >> np.uint64(32)).astype(np.uint32)
+
+
+def article_fingerprint(article: Dict) -> Optional[np.ndarray]:
+    return minhash(f"{article.get('title', '')} {article.get('content') or ''}")
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / NUM_HASHES
+
+
+def _bands(signature: np.ndarray) -> List[tuple]:
+    return [(band, signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+def cluster_fingerprints(signatures: List[Optional[np.ndarray]], threshold: float = 0.6) -> List[int]:
+    """
+    Gom các bài gần trùng (độ tương đồng >= threshold).
+    Trả về chỉ số phần tử đại diện của cụm cho từng phần tử.
+    """
+    representatives = []
+    heads = []
+    for i, signature in enumerate(signatures):
+        rep = i
+        if signature is not None:
+            for j in heads:
+                if similarity(signature, signatures[j]) >= threshold:
+                    rep = j
+                    break
+            if rep == i:
+                heads.append(i)
+        representatives.append(rep)
+    return representatives
+
+
+class FingerprintIndex:
+    """
+    Chỉ mục chữ ký MinHash -> khóa bài báo đã phân tích, tra cứu bằng LSH theo band
+    (16 band x 4 hàng: cặp bài có Jaccard ~0.7 gần như chắc chắn trùng ít nhất một band).
+    Mỗi scope (công ty) có bucket riêng: bài gần trùng chỉ được dùng lại trong cùng scope.
+    """
+
+    def __init__(self, max_entries: int = 20000, threshold: float = 0.6):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (scope, signature)
+        self._buckets: Dict[tuple, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, signature: Optional[np.ndarray], key: str, scope: str = ""):
+        if signature is None:
+            return
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = (scope, signature)
+        for band in _bands(signature):
+            self._buckets.setdefault((scope, band), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest, (old_scope, old_signature) = self._entries.popitem(last=False)
+            for band in _bands(old_signature):
+                bucket = self._buckets.get((old_scope, band))
+                if bucket is not None:
+                    bucket.discard(oldest)
+                    if not bucket:
+                        del self._buckets[(old_scope, band)]
+
+    def find(self, signature: Optional[np.ndarray], scope: str = "") -> Optional[str]:
+        if signature is None:
+            return None
+        candidates = set()
+        for band in _bands(signature):
+            candidates.update(self._buckets.get((scope, band), ()))
+        best, best_score = None, self.threshold
+        for key in candidates:
+            score = similarity(signature, self._entries[key][1])
+            if score >= best_score:
+                best, best_score = key, score
+        return best
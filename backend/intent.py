@@ -0,0 +1,169 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+from company_resolver import normalize_company_name
+
+# Từ viết hoa hay gặp trong câu hỏi nhưng trùng ticker (chỉ nhận khi có tiền tố $)
+AMBIGUOUS_TICKERS = {
+    "A", "C", "D", "V", "IT", "NOW", "ALL", "LOW", "SO", "ARE", "DE", "ED", "PM", "HAS",
+    "FAST", "CAT", "AI", "US", "EV", "ESG", "CEO", "IPO", "ETF", "UK", "EU", "GHG", "DEI",
+}
+
+
+class AhoCorasick:
+    """
+    Automaton Aho-Corasick: tìm tất cả pattern trong một lần quét văn bản (O(n + số kết quả))
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]
+        for pattern, value in patterns:
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern: str, value: object):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), value))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, object]]:
+        """Trả về danh sách (start, end, value) của mọi lần khớp"""
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                matches.append((i - length + 1, i + 1, value))
+        return matches
+
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not after.isalnum()
+
+
+def _leftmost_longest(matches: List[Tuple[int, int, object]]) -> List[Tuple[int, int, object]]:
+    selected, last_end = [], -1
+    for start, end, value in sorted(matches, key=lambda m: (m[0], -(m[1] - m[0]))):
+        if start >= last_end:
+            selected.append((start, end, value))
+            last_end = end
+    return selected
+
+
+# Dấu hiệu câu hỏi so sánh nhiều công ty
+_COMPARISON = re.compile(r"\b(vs\.?|versus|or|compare[sd]?|comparing|comparison|better|worse)\b", re.IGNORECASE)
+# Từ viết hoa (có thể là tên riêng) trong câu hỏi
+_CAPITALIZED = re.compile(r"\b[A-Z][\w&'.-]*")
+_SENTENCE_START = re.compile(r"(^|[.?!:;\"(]\s*)$")
+
+
+class LocalIntent(NamedTuple):
+    companies: List[str]
+    matches: List[str]  # đoạn văn bản đã khớp, để log / chẩn đoán
+    unresolved: List[str] = []  # từ viết hoa giữa câu không khớp công ty nào (có thể là công ty chưa nhận ra)
+    comparison: bool = False
+
+    @property
+    def confident(self) -> bool:
+        """
+        Đủ tin cậy để bỏ qua LLM: có công ty, không còn tên riêng nào chưa nhận ra,
+        và câu hỏi so sánh thì phải nhận ra ít nhất 2 công ty
+        """
+        if not self.companies or self.unresolved:
+            return False
+        return not self.comparison or len(self.companies) >= 2
+
+
+class IntentExtractor:
+    """
+    Trích tên công ty trong câu hỏi bằng automaton đa pattern dựng từ data.csv
+    (tên đầy đủ, tên chuẩn hóa bỏ Inc/Co/Corp, ticker) - không cần gọi LLM.
+    """
+
+    def __init__(self, names: Iterable[str], tickers: Iterable[str]):
+        aliases = {}
+        for name in names:
+            for alias in (" ".join(name.lower().split()), normalize_company_name(name)):
+                if len(alias) >= 3:
+                    aliases.setdefault(alias, name)
+        self._names = AhoCorasick(aliases.items())
+        self._tickers = AhoCorasick(
+            (ticker, name) for ticker, name in zip(tickers, names) if ticker
+        )
+
+    def extract(self, question: str) -> LocalIntent:
+        lowered = question.lower()
+        hits = []
+
+        for start, end, name in _leftmost_longest(self._names.find_all(lowered)):
+            if not _is_word_boundary(lowered, start, end):
+                continue
+            alias = question[start:end]
+            # Tên một từ (Apple, Target, News...) chỉ được nhận khi viết hoa và không đứng đầu câu
+            if " " not in alias.strip() and (not alias[:1].isupper() or start == 0):
+                continue
+            hits.append((start, end, name, alias))
+
+        for start, end, name in _leftmost_longest(self._tickers.find_all(question)):
+            if not _is_word_boundary(question, start, end):
+                continue
+            ticker = question[start:end]
+            has_dollar = start > 0 and question[start - 1] == "$"
+            if has_dollar or (len(ticker) >= 2 and ticker not in AMBIGUOUS_TICKERS):
+                hits.append((start - has_dollar, end, name, ("$" if has_dollar else "") + ticker))
+
+        hits.sort(key=lambda h: h[0])
+        unresolved = [
+            m.group() for m in _CAPITALIZED.finditer(question)
+            if not any(start <= m.start() < end for start, end, _, _ in hits)
+            and not _SENTENCE_START.search(question[:m.start()])
+            and m.group().rstrip(".").upper() not in AMBIGUOUS_TICKERS and m.group() != "I"
+        ]
+        return LocalIntent(
+            companies=list(dict.fromkeys(name for _, _, name, _ in hits)),
+            matches=[alias for _, _, _, alias in hits],
+            unresolved=unresolved,
+            comparison=bool(_COMPARISON.search(question)),
+        )
+
+
+def question_cache_key(question: str) -> str:
+    """Khóa cache cho câu hỏi: chữ thường, gộp khoảng trắng, bỏ dấu câu cuối"""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def parse_llm_intent(response: str) -> Tuple[List[str], List[str]]:
+    """Tách Companies / Keywords từ câu trả lời của Gemini (theo format trong prompt)"""
+    def field(label: str) -> List[str]:
+        match = re.search(rf"-\s*{label}:[ \t]*(.*)", response, re.IGNORECASE)
+        if not match:
+            return []
+        return [item.strip() for item in match.group(1).split(",") if item.strip()]
+
+    return field("Companies"), field("Keywords")
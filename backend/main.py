@@ -1,13 +1,28 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Query, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fetch_news import fetch_news
-from analyze_news import analyze_article, summarize_overall, extract_keywords_from_question_gemini
-import pandas as pd
-import re
+from fetch_news import fetch_news_async, news_client, NewsFetchError
+from analyze_news import analyze_articles, summarize_overall, extract_keywords_from_question_gemini
+import os
+import json
+import time
 import asyncio
-from rapidfuzz import process
+from company_resolver import CompanyResolver
+from esg_store import EsgStore
+from cache import TTLCache, article_key, company_scope
+from precompute import PrecomputeScheduler
+from relevance import dedup_articles, rank_articles
+from intent import IntentExtractor, parse_llm_intent
+from analysis_store import AnalysisStore
+from screening import EsgScreener, comparison_markdown
+from fingerprint import FingerprintIndex, article_fingerprint, cluster_fingerprints
+from work_scheduler import (
+    WorkScheduler, Priority, QueueFullError, DeadlineExceeded, ClientDisconnected, cancel_on_disconnect,
+)
+from shared_store import SharedStore
+from metrics import REGISTRY, HTTP_REQUESTS, stage, start_request_timing, server_timing_header
 
 
 app = FastAPI()
@@ -24,15 +39,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load ESG data
+# Load ESG data (bảng nhị phân cạnh data.csv, chỉ dựng lại khi CSV thay đổi)
 ESG_DATA_PATH = "data.csv"
 try:
-    esg_df = pd.read_csv(ESG_DATA_PATH)
-    esg_df['ticker'] = esg_df['ticker'].str.upper()
-    print("✅ Loaded ESG data columns:", esg_df.columns.tolist())
+    esg_store = EsgStore.load(ESG_DATA_PATH)
+    print(f"✅ Loaded ESG data: {len(esg_store)} companies")
 except Exception as e:
     print(f"❌ Failed to load ESG data: {e}")
-    esg_df = pd.DataFrame()
+    esg_store = EsgStore([])
+
+# Chỉ mục tên công ty dựng một lần khi khởi động
+company_resolver = CompanyResolver(esg_store.names, esg_store.tickers)
+intent_extractor = IntentExtractor(esg_store.names, esg_store.tickers)
+# Mảng điểm ESG + thống kê theo ngành cho các truy vấn sàng lọc / so sánh
+esg_screener = EsgScreener(esg_store)
 
 # Request / Response models
 class CompanyRequest(BaseModel):
@@ -49,6 +69,9 @@ class CompanyAnalysisResponse(BaseModel):
     overall_summary: str
     esg: dict = None
 
+# Số bài báo tối đa được phân tích bằng LLM cho câu hỏi không khớp công ty nào
+ASK_TOP_K = int(os.getenv("ASK_TOP_K", "8"))
+
 class AskRequest(BaseModel):
     question: str
 
@@ -57,120 +80,638 @@ class QuestionAnswerResponse(BaseModel):
     summary: str
     articles: List[ArticleAnalysis]
 
-# Cache
-news_cache = {}
-analysis_cache = {}
+# Cache: mỗi tầng có TTL riêng (tin tức cũ nhanh hơn điểm ESG) và giới hạn bộ nhớ
+news_cache = TTLCache(
+    "news",
+    ttl=float(os.getenv("NEWS_CACHE_TTL", "1800")),
+    max_entries=int(os.getenv("NEWS_CACHE_MAX_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("NEWS_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+)
+analysis_cache = TTLCache(
+    "analysis",
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "21600")),
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+article_cache = TTLCache(
+    "article",
+    ttl=float(os.getenv("ARTICLE_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("ARTICLE_CACHE_MAX_ENTRIES", "8192")),
+    max_bytes=int(os.getenv("ARTICLE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
 
-def find_best_matching_company(company_query: str, choices: List[str]) -> str:
-    match, score, _ = process.extractOne(company_query, choices)
-    return match if score > 75 else None
+# Kho kết quả dùng chung giữa các worker uvicorn và giữa các lần khởi động lại (SQLite WAL).
+# Đặt SHARED_STORE_PATH rỗng để tắt.
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", "shared_store.db")
+shared_store = None
+if SHARED_STORE_PATH:
+    try:
+        shared_store = SharedStore(
+            SHARED_STORE_PATH,
+            lease_ttl=float(os.getenv("SHARED_STORE_LEASE_TTL", "120")),
+            poll_interval=float(os.getenv("SHARED_STORE_POLL_INTERVAL", "0.5")),
+        )
+    except Exception as e:
+        print(f"❌ Failed to open shared store: {e}")
+
+@app.on_event("startup")
+async def warm_shared_store():
+    if shared_store is None:
+        return
+    await shared_store.call(
+        shared_store.prune, {"news": news_cache.ttl, "articles": article_cache.ttl, "companies": analysis_cache.ttl},
+    )
+    for path in filter(None, os.getenv("SHARED_STORE_WARM_FILES", "esg_analysis.json").split(",")):
+        loaded = await shared_store.call(shared_store.warm_load, path.strip())
+        if loaded:
+            print(f"✅ Warm-loaded {loaded} article analyses from {path.strip()}")
+
+# Kho phân tích có cấu trúc (append-only) dùng cho các truy vấn sàng lọc
+analysis_store = AnalysisStore(os.getenv("ANALYSIS_STORE_PATH", "analysis_store.ndjson"))
+
+# Điều phối công việc LLM / tin tức theo lớp ưu tiên: /api/ask > analyze_companies > bulk
+WORK_MAX_CONCURRENCY = int(os.getenv("WORK_MAX_CONCURRENCY", "8"))
+work_scheduler = WorkScheduler(
+    max_concurrency=WORK_MAX_CONCURRENCY,
+    class_concurrency={
+        Priority.EXPLICIT: int(os.getenv("WORK_EXPLICIT_MAX_ACTIVE", str(max(1, WORK_MAX_CONCURRENCY - 1)))),
+        Priority.BULK: int(os.getenv("WORK_BULK_MAX_ACTIVE", str(max(1, WORK_MAX_CONCURRENCY // 2)))),
+    },
+    queue_limits={
+        Priority.INTERACTIVE: int(os.getenv("WORK_INTERACTIVE_QUEUE", "100")),
+        Priority.EXPLICIT: int(os.getenv("WORK_EXPLICIT_QUEUE", "200")),
+        Priority.BULK: int(os.getenv("WORK_BULK_QUEUE", "2000")),
+    },
+)
+# Deadline mặc định (giây) cho từng lớp, client có thể ghi đè bằng header X-Request-Timeout
+DEFAULT_TIMEOUTS = {
+    Priority.INTERACTIVE: float(os.getenv("WORK_INTERACTIVE_TIMEOUT", "180")),
+    Priority.EXPLICIT: float(os.getenv("WORK_EXPLICIT_TIMEOUT", "600")),
+    Priority.BULK: None,
+}
+
+def request_timeout(http_request: Request, priority: Priority) -> Optional[float]:
+    value = http_request.headers.get("X-Request-Timeout")
+    try:
+        return float(value) if value else DEFAULT_TIMEOUTS[priority]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Request-Timeout header")
+
+async def run_admitted(http_request: Request, awaitable):
+    # Hủy công việc khi client ngắt kết nối, chuyển lỗi điều phối thành mã HTTP
+    try:
+        return await cancel_on_disconnect(http_request.is_disconnected, awaitable)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Server busy: {e}")
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+
+@app.get("/api/work_stats")
+async def work_stats():
+    return work_scheduler.stats()
+
+# Phát hiện bài báo gần trùng (MinHash) trong một request và giữa các request
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.6"))
+fingerprint_index = FingerprintIndex(
+    max_entries=article_cache.max_entries,
+    threshold=NEAR_DUPLICATE_THRESHOLD,
+)
 
-def analyze_company_esg(company: str) -> CompanyAnalysisResponse:
-    if company in analysis_cache:
-        return analysis_cache[company]
+@app.on_event("shutdown")
+async def close_news_client():
+    await news_client.aclose()
+    if shared_store is not None:
+        shared_store.close()
+
+def find_best_matching_company(company_query: str) -> str:
+    with stage("company_resolution"):
+        return company_resolver.best_match(company_query)
+
+def company_cache_key(company: str, best_match: str = None) -> str:
+    # Khóa theo tên chuẩn để "Walt Disney", "walt disney", "Walt Disney Co" dùng chung kết quả
+    return best_match or " ".join(company.lower().split())
+
+async def analyze_articles_cached(articles: List[dict], company: str) -> List[str]:
+    # Kết quả phân tích theo từng (công ty / keyword, bài báo): prompt phụ thuộc công ty nên không dùng chung
+    keys = [article_key(a.get('url', ''), a.get('content') or '', company) for a in articles]
+    results = [article_cache.get(key) for key in keys]
+    missing = [i for i, analysis in enumerate(results) if analysis is None]
+    if missing and shared_store is not None:
+        # Bài đã được worker khác (hoặc lần chạy trước) phân tích
+        stored = await shared_store.call(
+            shared_store.get_articles,
+            [keys[i] for i in missing], [articles[i].get('url', '') for i in missing], company, article_cache.ttl,
+        )
+        for i in missing:
+            if keys[i] in stored:
+                results[i] = article_cache[keys[i]] = stored[keys[i]]
+        missing = [i for i in missing if results[i] is None]
+    if not missing:
+        return results
+
+    # Bản sao gần trùng (tin syndicated) trong request dùng chung bài đại diện của cụm,
+    # đại diện đã có bản gần trùng được phân tích trước đó cho cùng công ty thì lấy lại kết quả trong cache
+    signatures = {i: article_fingerprint(articles[i]) for i in missing}
+    clusters = cluster_fingerprints([signatures[i] for i in missing], NEAR_DUPLICATE_THRESHOLD)
+    representatives = {}
+    for i, rep in zip(missing, clusters):
+        representatives.setdefault(missing[rep], []).append(i)
+
+    to_analyze = []
+    for rep, members in representatives.items():
+        similar_key = fingerprint_index.find(signatures[rep], company_scope(company))
+        analysis = article_cache.get(similar_key) if similar_key else None
+        if analysis is None:
+            to_analyze.append(rep)
+            continue
+        for i in members:
+            results[i] = analysis
+            article_cache[keys[i]] = analysis
+
+    if to_analyze:
+        items = [(articles[i].get('title', ''), articles[i].get('content') or '') for i in to_analyze]
+        with stage("article_analysis"):
+            fresh = await analyze_articles(items, company)
+        if shared_store is not None:
+            await shared_store.call(shared_store.put_articles, company, [
+                (keys[i], articles[i].get('url', ''), analysis) for i, analysis in zip(to_analyze, fresh)
+                if not analysis.startswith("Gemini Analysis Failed")
+            ])
+        for rep, analysis in zip(to_analyze, fresh):
+            failed = analysis.startswith("Gemini Analysis Failed")
+            if not failed:
+                fingerprint_index.add(signatures[rep], keys[rep], company_scope(company))
+            for i in representatives[rep]:
+                results[i] = analysis
+                if not failed:
+                    article_cache[keys[i]] = analysis
+    return results
+
+async def load_shared_company_analysis(cache_key: str, newer_than: float = 0) -> Optional[CompanyAnalysisResponse]:
+    if shared_store is None:
+        return None
+    data = await shared_store.call(shared_store.get_company, cache_key, analysis_cache.ttl, newer_than)
+    if data is None:
+        return None
+    response = CompanyAnalysisResponse(**data)
+    analysis_cache[cache_key] = response
+    return response
 
-    company_names = esg_df['name'].tolist()
-    best_match = find_best_matching_company(company, company_names)
+async def get_cached_company_analysis(company: str) -> Optional[CompanyAnalysisResponse]:
+    cache_key = company_cache_key(company, find_best_matching_company(company))
+    return analysis_cache.get(cache_key) or await load_shared_company_analysis(cache_key)
+
+async def analyze_company_esg(company: str, refresh: bool = False) -> CompanyAnalysisResponse:
+    """
+    refresh=True bỏ qua cache tin tức / kết quả công ty (dùng bởi job precompute),
+    các bài báo đã phân tích vẫn lấy lại từ article_cache.
+    """
+    best_match = find_best_matching_company(company)
+
+    cache_key = company_cache_key(company, best_match)
+    if not refresh:
+        if best_match:
+            precompute_scheduler.record_request(best_match)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if shared_store is None:
+        return await compute_company_esg(company, best_match, cache_key, refresh)
+
+    # Mỗi công ty chỉ được một worker tính tại một thời điểm, các worker khác chờ rồi đọc kết quả.
+    # Khi refresh chỉ nhận kết quả được ghi sau thời điểm bắt đầu.
+    newer_than = time.time() if refresh else 0
+    return await shared_store.single_flight(
+        f"company:{cache_key}",
+        lambda: compute_company_esg(company, best_match, cache_key, refresh),
+        lambda: load_shared_company_analysis(cache_key, newer_than),
+    )
 
+async def get_news(search_name: str, refresh: bool = False) -> Optional[List[dict]]:
+    if refresh:
+        return None
+    articles = news_cache.get(search_name)
+    if not articles and shared_store is not None:
+        articles = await shared_store.call(shared_store.get_news, search_name, news_cache.ttl)
+        if articles:
+            news_cache[search_name] = articles
+    return articles
+
+async def compute_company_esg(company: str, best_match: Optional[str], cache_key: str,
+                              refresh: bool = False) -> CompanyAnalysisResponse:
     # Nếu không tìm được tên chuẩn thì fallback lại company gốc
     search_name = best_match or company
 
-    articles = news_cache.get(search_name)
+    articles = await get_news(search_name, refresh)
+    upstream_failed = False
     if not articles:
-        articles = fetch_news(search_name, limit=5)   # <-- Dùng tên chuẩn để tìm bài
-        news_cache[search_name] = articles
-
+        # Các request đồng thời cho cùng search_name dùng chung một lời gọi NewsAPI
+        try:
+            with stage("news_fetch"):
+                articles = await fetch_news_async(search_name, limit=5)   # <-- Dùng tên chuẩn để tìm bài
+        except NewsFetchError:
+            # Làm mới nền: giữ nguyên kết quả cũ trong cache / kho và báo lỗi cho scheduler
+            if refresh:
+                raise
+            articles, upstream_failed = [], True
+        else:
+            news_cache[search_name] = articles
+            if shared_store is not None and articles:
+                await shared_store.call(shared_store.put_news, search_name, articles)
+
+    valid_articles = [a for a in articles if a.get('title') and a.get('content')]
     analyzed_articles = []
     analyses = []
-    for article in articles:
-        title = article.get('title', '')
-        content = article.get('content', '')
-        if not title or not content:
-            continue
-        try:
-            analysis = analyze_article(title, content, search_name)
-            analyses.append(analysis)
-            analyzed_articles.append(
-                ArticleAnalysis(
-                    title=title,
-                    url=article.get('url', ''),
-                    analysis=analysis
-                )
+    try:
+        # Các bài báo được phân tích song song, engine lo rate limit và số lời gọi đồng thời
+        analyses = await analyze_articles_cached(valid_articles, search_name)
+        analyzed_articles = [
+            ArticleAnalysis(
+                title=article['title'],
+                url=article.get('url', ''),
+                analysis=analysis
             )
-        except Exception as e:
-            print(f"⚠️ Failed to analyze article: {e}")
-
-    esg_info = {}
-    if best_match:
-        row = esg_df[esg_df['name'] == best_match].iloc[0]
-        esg_info = {
-            "environment_score": int(row["environment_score"]) if pd.notnull(row["environment_score"]) else None,
-            "social_score": int(row["social_score"]) if pd.notnull(row["social_score"]) else None,
-            "governance_score": int(row["governance_score"]) if pd.notnull(row["governance_score"]) else None,
-            "total_score": int(row["total_score"]) if pd.notnull(row["total_score"]) else None,
-            "environment_grade": row["environment_grade"],
-            "social_grade": row["social_grade"],
-            "governance_grade": row["governance_grade"],
-            "total_grade": row["total_grade"],
-        }
-
-    overall_summary = summarize_overall(search_name, analyses)
+            for article, analysis in zip(valid_articles, analyses)
+        ]
+        # Lưu bản có cấu trúc của từng bài phân tích để sàng lọc / xếp hạng sau này không cần LLM
+        # (parse + ghi file chạy ngoài event loop)
+        await asyncio.to_thread(analysis_store.add_many, best_match or search_name, [
+            (article, analysis, article_key(article.get('url', ''), article.get('content') or '', search_name))
+            for article, analysis in zip(valid_articles, analyses)
+        ])
+    except Exception as e:
+        print(f"⚠️ Failed to analyze articles: {e}")
+
+    with stage("esg_lookup"):
+        esg_info = esg_store.esg_dict(best_match) if best_match else {}
+
+    # Bản sao gần trùng có cùng kết quả phân tích, chỉ đưa một lần vào bản tóm tắt
+    with stage("summary"):
+        overall_summary = await summarize_overall(search_name, list(dict.fromkeys(analyses)))
     response = CompanyAnalysisResponse(
         company=best_match or company,
         articles=analyzed_articles,
         overall_summary=overall_summary,
         esg=esg_info
     )
-    analysis_cache[company] = response
+    # Kết quả rỗng do NewsAPI lỗi chỉ trả cho request này, không cache / lưu vào kho
+    if not upstream_failed:
+        analysis_cache[cache_key] = response
+        if shared_store is not None:
+            await shared_store.call(shared_store.put_company, cache_key, response.model_dump())
     return response
 
+async def analyze_companies_scheduled(companies: List[str], priority: Priority,
+                                      timeout: Optional[float] = None) -> List[CompanyAnalysisResponse]:
+    work_scheduler.ensure_capacity(priority, len(companies))
+    tasks = [
+        asyncio.ensure_future(work_scheduler.run(priority, lambda c=c: analyze_company_esg(c), timeout))
+        for c in companies
+    ]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # Một công ty lỗi / request bị hủy thì không tiếp tục tiêu quota cho các công ty còn lại
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
 @app.post("/api/analyze_companies", response_model=List[CompanyAnalysisResponse])
-async def analyze_companies_api(request: CompanyRequest):
-    async def run_in_thread(company):
-        return await asyncio.to_thread(analyze_company_esg, company)
-    tasks = [run_in_thread(company) for company in request.companies]
-    return await asyncio.gather(*tasks)
+async def analyze_companies_api(request: CompanyRequest, http_request: Request):
+    timeout = request_timeout(http_request, Priority.EXPLICIT)
+    return await run_admitted(
+        http_request, analyze_companies_scheduled(request.companies, Priority.EXPLICIT, timeout)
+    )
 
-@app.get("/api/analyze_default_companies", response_model=List[CompanyAnalysisResponse])
-async def analyze_default_companies():
+def load_company_list() -> List[str]:
     try:
         with open("company_list.txt", "r") as f:
-            companies = [line.strip() for line in f if line.strip()]
+            return [line.strip() for line in f if line.strip()]
     except FileNotFoundError:
         return []
 
-    async def run_in_thread(company):
-        return await asyncio.to_thread(analyze_company_esg, company)
-    tasks = [run_in_thread(c) for c in companies]
-    return await asyncio.gather(*tasks)
+@app.get("/api/analyze_default_companies", response_model=List[CompanyAnalysisResponse])
+async def analyze_default_companies(http_request: Request):
+    companies = load_company_list()
+    timeout = request_timeout(http_request, Priority.BULK)
+    return await run_admitted(http_request, analyze_companies_scheduled(companies, Priority.BULK, timeout))
+
+async def precompute_refresh(company: str):
+    if shared_store is not None:
+        # Worker khác (hoặc lần chạy trước) đã làm mới công ty này gần đây: không tính lại
+        cache_key = company_cache_key(company, find_best_matching_company(company))
+        fresh = await load_shared_company_analysis(cache_key, time.time() - precompute_scheduler.stale_after)
+        if fresh is not None:
+            return fresh
+    return await work_scheduler.run(Priority.BULK, lambda: analyze_company_esg(company, refresh=True))
+
+async def run_precompute_exclusive(cycle) -> bool:
+    # Nhiều worker uvicorn: chỉ worker giữ lease "precompute" trong kho dùng chung chạy chu kỳ
+    if shared_store is None:
+        await cycle()
+        return True
+    return await shared_store.run_exclusive("precompute", cycle)
+
+# Job nền giữ ấm cache cho toàn bộ company_list.txt
+precompute_scheduler = PrecomputeScheduler(
+    refresh=precompute_refresh,
+    run_exclusive=run_precompute_exclusive,
+    load_companies=load_company_list,
+    interval=float(os.getenv("PRECOMPUTE_INTERVAL", "3600")),
+    stale_after=float(os.getenv("PRECOMPUTE_STALE_AFTER", str(0.8 * analysis_cache.ttl))),
+    concurrency=int(os.getenv("PRECOMPUTE_CONCURRENCY", "2")),
+    checkpoint_path=os.getenv("PRECOMPUTE_CHECKPOINT", "precompute_state.json"),
+)
+
+@app.on_event("startup")
+async def start_precompute():
+    if os.getenv("PRECOMPUTE_ENABLED", "false").lower() in ("1", "true", "yes"):
+        precompute_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_precompute():
+    await precompute_scheduler.stop()
+
+@app.get("/api/precompute/status")
+async def precompute_status():
+    return precompute_scheduler.status()
+
+STREAM_MAX_CONCURRENCY = int(os.getenv("STREAM_MAX_CONCURRENCY", "16"))
+
+def _format_event(event: str, payload: dict, fmt: str) -> str:
+    data = json.dumps({"type": event, **payload}, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def _stream_company_analyses(companies: List[str], offset: int, fmt: str, heartbeat: float, concurrency: int):
+    total = len(companies)
+    done = 0
+
+    # Công ty đã có trong cache được trả về ngay
+    pending = []
+    for index, company in enumerate(companies, start=offset):
+        cached = await get_cached_company_analysis(company)
+        if cached is not None:
+            done += 1
+            yield _format_event("result", {"index": index, "cached": True, "data": cached.model_dump()}, fmt)
+        else:
+            pending.append((index, company))
+    yield _format_event("progress", {"done": done, "total": total}, fmt)
+
+    work = asyncio.Queue()
+    for item in pending:
+        work.put_nowait(item)
+    results = asyncio.Queue()
+
+    async def worker():
+        while True:
+            try:
+                index, company = work.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                response = await work_scheduler.run(Priority.BULK, lambda: analyze_company_esg(company))
+                await results.put(("result", {"index": index, "cached": False, "data": response.model_dump()}))
+            except Exception as e:
+                await results.put(("error", {"index": index, "company": company, "error": str(e)}))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(pending)))]
+    try:
+        remaining = len(pending)
+        while remaining:
+            try:
+                event, payload = await asyncio.wait_for(results.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Heartbeat giữ kết nối (proxy không timeout) và báo tiến độ cho frontend
+                yield _format_event("progress", {"done": done, "total": total}, fmt)
+                continue
+            remaining -= 1
+            done += 1
+            yield _format_event(event, payload, fmt)
+        yield _format_event("done", {"done": done, "total": total}, fmt)
+    finally:
+        # Client ngắt kết nối hoặc stream kết thúc: hủy các công việc còn lại
+        for task in workers:
+            task.cancel()
+
+@app.get("/api/analyze_default_companies/stream")
+async def stream_default_companies(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    heartbeat: float = Query(5.0, gt=0, le=60),
+    concurrency: int = Query(8, ge=1),
+):
+    companies = load_company_list()
+    end = offset + limit if limit is not None else None
+    companies = companies[offset:end]
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        _stream_company_analyses(companies, offset, format, heartbeat, min(concurrency, STREAM_MAX_CONCURRENCY)),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/analyses/screen")
+async def screen_analyses(
+    industry: Optional[str] = None,
+    recommendation: Optional[str] = Query(None, pattern="(?i)^(strong buy|buy|hold|sell|strong sell|monitor|avoid)$"),
+    days: Optional[float] = Query(None, gt=0),
+    sentiment: Optional[str] = Query(None, pattern="^(positive|neutral|negative)$"),
+    risk: Optional[str] = Query(None, pattern="^(environment|social|governance)$"),
+    sort_by: str = Query("matching_articles", pattern="^(matching_articles|avg_sentiment|latest_analyzed_at|environment_score|social_score|governance_score|total_score)$"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """
+    Lọc / xếp hạng công ty theo các bài phân tích đã lưu, ghép với điểm ESG trong data.csv.
+    Ví dụ: /api/analyses/screen?industry=Automobiles&recommendation=Sell&days=7
+    """
+    # Đọc thêm các dòng do worker khác ghi rồi lọc, ngoài event loop
+    return await asyncio.to_thread(
+        analysis_store.query, esg_store, industry=industry, recommendation=recommendation, days=days,
+        sentiment=sentiment, risk=risk, sort_by=sort_by, limit=limit,
+    )
+
+@app.get("/api/screen")
+async def screen_companies(
+    industry: Optional[str] = None,
+    sort_by: str = Query("total_score", pattern="^(environment|social|governance|total)_score$"),
+    relative: bool = Query(False, description="Sort by industry z-score instead of raw score"),
+    ascending: bool = False,
+    top: int = Query(20, ge=1, le=1000),
+    min_environment_score: Optional[float] = None,
+    min_social_score: Optional[float] = None,
+    min_governance_score: Optional[float] = None,
+    min_total_score: Optional[float] = None,
+    max_total_score: Optional[float] = None,
+    min_industry_percentile: Optional[float] = Query(None, ge=0, le=100),
+):
+    min_scores = {
+        field: value for field, value in (
+            ("environment_score", min_environment_score),
+            ("social_score", min_social_score),
+            ("governance_score", min_governance_score),
+            ("total_score", min_total_score),
+        ) if value is not None
+    }
+    max_scores = {"total_score": max_total_score} if max_total_score is not None else {}
+    min_percentile = {sort_by: min_industry_percentile} if min_industry_percentile is not None else {}
+    return esg_screener.screen(
+        industry=industry, min_scores=min_scores, max_scores=max_scores, min_percentile=min_percentile,
+        sort_by=sort_by, relative=relative, ascending=ascending, top=top,
+    )
+
+# Ngưỡng so khớp tên (fuzz.ratio trên tên chuẩn hóa) cho /api/compare
+COMPARE_MATCH_THRESHOLD = float(os.getenv("COMPARE_MATCH_THRESHOLD", "90"))
+
+@app.get("/api/compare")
+async def compare_companies(companies: str = Query(..., description="Comma-separated tickers or company names")):
+    queries = [c.strip() for c in companies.split(",") if c.strip()]
+    # Ticker trước (không phân biệt hoa thường), còn lại chỉ nhận tên khớp chính xác / gần đúng cả chuỗi
+    records = [esg_store.get_by_ticker(q.lstrip("$")) for q in queries]
+    names = [record.name if record else None for record in records]
+    pending = [i for i, name in enumerate(names) if name is None]
+    with stage("company_resolution"):
+        matches = company_resolver.match_names([queries[i] for i in pending], COMPARE_MATCH_THRESHOLD)
+    for i, match in zip(pending, matches):
+        names[i] = match.name
+    return {
+        "companies": esg_screener.compare([name for name in names if name]),
+        "unmatched": [q for q, name in zip(queries, names) if not name],
+    }
+
+@app.get("/api/industries")
+async def list_industries():
+    return esg_screener.industries()
+
+@app.get("/api/cache_stats")
+async def cache_stats():
+    stats = [cache.stats() for cache in (news_cache, analysis_cache, article_cache)]
+    if shared_store is not None:
+        stats.append({"name": "shared_store", **(await shared_store.call(shared_store.stats))})
+    return stats
+
+# Gauge đọc lúc scrape /metrics: hiệu quả cache và tải của bộ điều phối
+def _cache_samples(field: str):
+    for cache in (news_cache, analysis_cache, article_cache):
+        yield {"cache": cache.name}, cache.stats()[field]
+
+REGISTRY.gauge("esg_cache_hits", "Cache hits since start", lambda: _cache_samples("hits"))
+REGISTRY.gauge("esg_cache_misses", "Cache misses since start", lambda: _cache_samples("misses"))
+REGISTRY.gauge("esg_cache_hit_ratio", "Cache hit ratio since start", lambda: _cache_samples("hit_ratio"))
+REGISTRY.gauge("esg_cache_entries", "Entries currently cached", lambda: _cache_samples("entries"))
+REGISTRY.gauge("esg_cache_bytes", "Estimated bytes currently cached", lambda: _cache_samples("bytes"))
+REGISTRY.gauge("esg_cache_evictions", "Cache evictions since start", lambda: _cache_samples("evictions"))
+REGISTRY.gauge(
+    "esg_news_coalesced_calls", "NewsAPI requests served by an in-flight duplicate",
+    lambda: [({}, news_client.coalesced_calls)],
+)
+REGISTRY.gauge(
+    "esg_shared_store_company_runs", "Company analyses computed here vs. read from another worker",
+    lambda: [({"source": "computed"}, shared_store.computed), ({"source": "waited"}, shared_store.waited)]
+    if shared_store is not None else [],
+)
+
+def _work_samples(field: str):
+    for name, values in work_scheduler.stats()["classes"].items():
+        yield {"priority": name}, values[field]
+
+REGISTRY.gauge("esg_work_active", "Admitted work items currently running", lambda: _work_samples("active"))
+REGISTRY.gauge("esg_work_queued", "Work items waiting for a slot", lambda: _work_samples("queued"))
+REGISTRY.gauge("esg_work_rejected", "Work items rejected because the queue was full", lambda: _work_samples("rejected"))
+
+# Header Server-Timing theo từng request: bật cho mọi request bằng METRICS_TIMING_HEADER=true,
+# hoặc cho từng request khi client gửi header X-Timing: 1
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+@app.middleware("http")
+async def record_request_metrics(http_request: Request, call_next):
+    timings = None
+    if METRICS_TIMING_HEADER or http_request.headers.get("X-Timing") in ("1", "true"):
+        timings = start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(http_request)
+    elapsed = time.perf_counter() - start
+    route = http_request.scope.get("route")
+    HTTP_REQUESTS.observe(
+        elapsed,
+        method=http_request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    if timings is not None:
+        header = server_timing_header(timings)
+        response.headers["Server-Timing"] = f"{header}, total;dur={elapsed * 1000:.1f}" if header \
+            else f"total;dur={elapsed * 1000:.1f}"
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/ask", response_model=QuestionAnswerResponse)
-async def ask_ai(request: AskRequest):
-    question = request.question
-    response = extract_keywords_from_question_gemini(question)
-    print("🔍 Gemini response:", response)
-
-    # Tách danh sách Companies và Keywords trong response (theo format Gemini trả về)
-    match_c = re.search(r"- Companies:\s*(.*?)(?:\n|$)", response, re.IGNORECASE)
-    companies = [c.strip() for c in match_c.group(1).split(",")] if match_c else []
-
-    match_k = re.search(r"- Keywords:\s*(.*?)(?:\n|$)", response, re.IGNORECASE)
-    keywords = [k.strip() for k in match_k.group(1).split(",")] if match_k else []
-
-    # Lấy danh sách tên công ty chuẩn từ dataset ESG
-    company_names = esg_df['name'].tolist()
-    
-    # Tìm công ty gần đúng đầu tiên trong companies + keywords
+async def ask_ai(request: AskRequest, http_request: Request):
+    timeout = request_timeout(http_request, Priority.INTERACTIVE)
+    return await run_admitted(
+        http_request, work_scheduler.run(Priority.INTERACTIVE, lambda: answer_question(request.question), timeout)
+    )
+
+async def compare_from_scores(question: str, companies: List[str]) -> QuestionAnswerResponse:
+    # Câu hỏi so sánh nhiều công ty: trả lời từ điểm ESG có sẵn, kèm bài phân tích nếu đã có trong cache
+    with stage("esg_lookup"):
+        rows = esg_screener.compare(companies)
+    articles = []
+    for company in companies:
+        cached = await get_cached_company_analysis(company)
+        if cached is not None:
+            articles.extend(cached.articles)
+    return QuestionAnswerResponse(
+        question=question,
+        summary=comparison_markdown(rows),
+        articles=articles,
+    )
+
+async def answer_question(question: str) -> QuestionAnswerResponse:
+    # Fast path: tìm tên công ty / ticker ngay trong câu hỏi, khỏi gọi Gemini.
+    # Câu hỏi so sánh mà chỉ nhận ra một công ty, hoặc còn tên riêng chưa nhận ra, thì vẫn hỏi LLM
+    with stage("company_resolution"):
+        local = intent_extractor.extract(question)
+    if local.confident:
+        print(f"⚡ Local intent: {local.matches} -> {local.companies}")
+        companies, keywords = local.companies, []
+        if len(local.companies) >= 2:
+            return await compare_from_scores(question, local.companies)
+    else:
+        if local.companies:
+            print(f"⚡ Local intent not confident: {local.matches}, unresolved={local.unresolved}")
+        with stage("keyword_extraction"):
+            response = await extract_keywords_from_question_gemini(question)
+        print("🔍 Gemini response:", response)
+        # Tách danh sách Companies và Keywords trong response (theo format Gemini trả về)
+        companies, keywords = parse_llm_intent(response)
+
+    # Tìm công ty gần đúng đầu tiên trong companies, keyword chỉ được nhận khi khớp chính xác ticker / tên
     matched_company = None
-    for c in companies + keywords:
-        match = find_best_matching_company(c, company_names)
-        print(f"Trying to match '{c}' -> Found: '{match}'")
-        if match:
-            matched_company = match
+    with stage("company_resolution"):
+        matches = company_resolver.resolve_many(companies) + company_resolver.resolve_many(keywords, fuzzy=False)
+    for match in matches:
+        print(f"Trying to match '{match.query}' -> Found: '{match.name}' ({match.method}, score={match.score:.1f})")
+        if match.name:
+            matched_company = match.name
             break
 
+    # LLM nhận ra nhiều công ty (vd "Disney vs GM"): trả lời so sánh như fast path
+    matched_companies = list(dict.fromkeys(m.name for m in matches[:len(companies)] if m.name))
+    if len(matched_companies) >= 2:
+        return await compare_from_scores(question, matched_companies)
+
     # Nếu tìm được tên công ty chuẩn thì phân tích và trả kết quả
     if matched_company:
-        result = analyze_company_esg(matched_company)
+        result = await analyze_company_esg(matched_company)
 
         total_score = result.esg.get("total_score", 0) if result.esg else 0
         risk_level = "Low" if total_score > 1000 else "Moderate" if total_score > 700 else "High"
@@ -191,28 +732,47 @@ async def ask_ai(request: AskRequest):
             articles=result.articles
         )
 
-    # Nếu không tìm được công ty chuẩn, fallback tìm bài báo theo keywords
-    all_articles = []
-    for keyword in keywords:
-        articles = fetch_news(keyword)
+    # Nếu không tìm được công ty chuẩn, fallback tìm bài báo theo keywords (song song cho mọi keyword)
+    with stage("news_fetch"):
+        fetched = await asyncio.gather(*(fetch_news_async(keyword) for keyword in keywords), return_exceptions=True)
+    candidates = []
+    for keyword, articles in zip(keywords, fetched):
+        if isinstance(articles, NewsFetchError):
+            continue
+        if isinstance(articles, BaseException):
+            raise articles
         for article in articles:
-            try:
-                analysis = analyze_article(article['title'], article['content'], keyword)
-                all_articles.append({
-                    "title": article['title'],
-                    "url": article['url'],
-                    "analysis": analysis
-                })
-            except Exception as e:
-                print(f"⚠️ Failed to analyze fallback article: {e}")
-                continue
-
-    # Sắp xếp bài báo theo mức độ liên quan (dựa vào keywords)
-    def relevance_score(article):
-        return sum(kw.lower() in article['title'].lower() for kw in keywords)
-
-    sorted_articles = sorted(all_articles, key=relevance_score, reverse=True)
-    overall_summary = summarize_overall(question, [a["analysis"] for a in sorted_articles])
+            if article.get('title') and article.get('content'):
+                candidates.append({**article, "keyword": keyword})
+
+    # Bỏ bài trùng giữa các keyword, xếp hạng cục bộ (BM25) và chỉ gửi top-k bài cho LLM
+    with stage("ranking"):
+        ranked = rank_articles(dedup_articles(candidates), " ".join(keywords) or question, ASK_TOP_K)
+    top_articles = [article for article, _ in ranked]
+
+    by_keyword = {}
+    for article in top_articles:
+        by_keyword.setdefault(article["keyword"], []).append(article)
+    grouped = list(by_keyword.items())
+    results = await asyncio.gather(
+        *(analyze_articles_cached(articles, keyword) for keyword, articles in grouped),
+        return_exceptions=True,
+    )
+    analysis_by_url = {}
+    for (keyword, articles), analyses in zip(grouped, results):
+        if isinstance(analyses, Exception):
+            print(f"⚠️ Failed to analyze fallback articles: {analyses}")
+            continue
+        for article, analysis in zip(articles, analyses):
+            analysis_by_url[article['url']] = analysis
+
+    # Giữ thứ tự theo điểm liên quan
+    sorted_articles = [
+        {"title": a['title'], "url": a['url'], "analysis": analysis_by_url[a['url']]}
+        for a in top_articles if a['url'] in analysis_by_url
+    ]
+    with stage("summary"):
+        overall_summary = await summarize_overall(question, list(dict.fromkeys(a["analysis"] for a in sorted_articles)))
 
     return QuestionAnswerResponse(
         question=question,
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class PrecomputeScheduler:
+    """
+    Job nền làm mới định kỳ tin tức + phân tích ESG cho toàn bộ company_list.txt,
+    để request của người dùng hầu như luôn trúng cache.
+
+    - Mỗi chu kỳ chỉ làm mới các công ty đã cũ (quá stale_after giây), ưu tiên công ty
+      chưa từng được làm mới, rồi công ty được hỏi nhiều nhất, rồi công ty cũ nhất.
+    - Tiến độ được ghi ra file checkpoint sau mỗi công ty nên khi khởi động lại sẽ
+      tiếp tục từ các công ty chưa được làm mới.
+    - run_exclusive (nếu có) bọc mỗi chu kỳ để chỉ một worker chạy tại một thời điểm;
+      trả về False khi worker khác đang chạy thì chu kỳ này được bỏ qua.
+    """
+
+    def __init__(self, refresh: Callable[[str], Awaitable], load_companies: Callable[[], List[str]],
+                 interval: float = 3600, stale_after: float = 6 * 3600, concurrency: int = 2,
+                 checkpoint_path: str = "precompute_state.json",
+                 run_exclusive: Optional[Callable[[Callable[[], Awaitable]], Awaitable[bool]]] = None):
+        self.refresh = refresh
+        self.run_exclusive = run_exclusive
+        self.load_companies = load_companies
+        self.interval = interval
+        self.stale_after = stale_after
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+        self.companies: Dict[str, Dict] = {}
+        self.queue: deque = deque()
+        self.in_progress: set = set()
+        self.cycles = 0
+        self.skipped_cycles = 0
+        self.last_cycle_started: Optional[float] = None
+        self.last_cycle_finished: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._load_checkpoint()
+
+    def _entry(self, company: str) -> Dict:
+        return self.companies.setdefault(
+            company, {"last_refresh": None, "requests": 0, "failures": 0, "last_error": None}
+        )
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.companies = data.get("companies", {})
+            self.cycles = data.get("cycles", 0)
+            print(f"✅ Loaded precompute checkpoint: {len(self.companies)} companies")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Failed to load precompute checkpoint: {e}")
+
+    def _save_checkpoint(self):
+        # File tạm riêng cho từng process: nhiều worker ghi cùng lúc không cắt cụt checkpoint của nhau
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"cycles": self.cycles, "companies": self.companies}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.checkpoint_path)
+        except OSError as e:
+            print(f"⚠️ Failed to write precompute checkpoint: {e}")
+
+    def record_request(self, company: str):
+        self._entry(company)["requests"] += 1
+
+    def _priority(self, company: str):
+        entry = self._entry(company)
+        last_refresh = entry["last_refresh"]
+        return (last_refresh is not None, -entry["requests"], last_refresh or 0)
+
+    def stale_companies(self) -> List[str]:
+        now = time.time()
+        stale = []
+        for company in self.load_companies():
+            last_refresh = self._entry(company)["last_refresh"]
+            if last_refresh is None or now - last_refresh >= self.stale_after:
+                stale.append(company)
+        return sorted(stale, key=self._priority)
+
+    async def _refresh_one(self, company: str):
+        entry = self._entry(company)
+        self.in_progress.add(company)
+        try:
+            await self.refresh(company)
+            entry["last_refresh"] = time.time()
+            entry["last_error"] = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            entry["failures"] += 1
+            entry["last_error"] = str(e)
+            print(f"⚠️ Precompute failed for '{company}': {e}")
+        finally:
+            self.in_progress.discard(company)
+            self._save_checkpoint()
+
+    async def run_cycle(self):
+        self.last_cycle_started = time.time()
+        self.queue = deque(self.stale_companies())
+
+        async def worker():
+            while self.queue:
+                await self._refresh_one(self.queue.popleft())
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        self.cycles += 1
+        self.last_cycle_finished = time.time()
+        self._save_checkpoint()
+
+    async def _run_forever(self):
+        while True:
+            try:
+                if self.run_exclusive is None:
+                    await self.run_cycle()
+                elif not await self.run_exclusive(self.run_cycle):
+                    self.skipped_cycles += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Precompute cycle failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._save_checkpoint()
+
+    def status(self) -> Dict:
+        failures = {c: e for c, e in self.companies.items() if e["failures"]}
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "stale_after": self.stale_after,
+            "cycles": self.cycles,
+            "skipped_cycles": self.skipped_cycles,
+            "last_cycle_started": self.last_cycle_started,
+            "last_cycle_finished": self.last_cycle_finished,
+            "queue_depth": len(self.queue),
+            "in_progress": sorted(self.in_progress),
+            "failures": failures,
+            "companies": self.companies,
+        }
@@ -0,0 +1,77 @@
+import re
+from typing import Dict, List, Tuple
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "how", "i",
+    "in", "is", "it", "its", "of", "on", "or", "should", "that", "the", "this", "to", "was",
+    "what", "which", "who", "will", "with", "does", "do", "about", "any", "can", "me",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def _normalize_title(title: str) -> str:
+    return " ".join(_TOKEN.findall((title or "").lower()))
+
+
+def dedup_articles(articles: List[Dict]) -> List[Dict]:
+    """
+    Bỏ bài báo trùng (cùng URL hoặc cùng tiêu đề sau khi chuẩn hóa), giữ bài xuất hiện đầu tiên
+    """
+    seen_urls, seen_titles = set(), set()
+    unique = []
+    for article in articles:
+        url = (article.get("url") or "").strip()
+        title = _normalize_title(article.get("title", ""))
+        if (url and url in seen_urls) or (title and title in seen_titles):
+            continue
+        if url:
+            seen_urls.add(url)
+        if title:
+            seen_titles.add(title)
+        unique.append(article)
+    return unique
+
+
+def bm25_scores(query_terms: List[str], documents: List[List[str]], k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """
+    Điểm BM25 của từng tài liệu (đã tokenize) với tập từ khóa truy vấn
+    """
+    terms = list(dict.fromkeys(query_terms))
+    if not documents or not terms:
+        return np.zeros(len(documents))
+    index = {term: j for j, term in enumerate(terms)}
+
+    # Ma trận tần suất (số tài liệu x số từ khóa)
+    tf = np.zeros((len(documents), len(terms)))
+    for i, tokens in enumerate(documents):
+        for token in tokens:
+            j = index.get(token)
+            if j is not None:
+                tf[i, j] += 1
+
+    doc_len = np.array([len(tokens) for tokens in documents], dtype=float)
+    avg_len = doc_len.mean() or 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * doc_len / avg_len)
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def rank_articles(articles: List[Dict], query: str, top_k: int) -> List[Tuple[Dict, float]]:
+    """
+    Xếp hạng bài báo theo BM25 trên tiêu đề (nhân đôi trọng số) + nội dung, trả về top_k bài
+    """
+    documents = [
+        tokenize(a.get("title", "")) * 2 + tokenize(a.get("content") or "")
+        for a in articles
+    ]
+    scores = bm25_scores(tokenize(query), documents)
+    # Sắp xếp ổn định: cùng điểm thì giữ thứ tự của NewsAPI (theo relevancy)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [(articles[i], float(scores[i])) for i in order]
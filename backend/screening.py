@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional
+import numpy as np
+
+PILLARS = ("environment_score", "social_score", "governance_score", "total_score")
+UNKNOWN_INDUSTRY = "Unknown"
+
+
+class EsgScreener:
+    """
+    Sàng lọc / so sánh công ty trên các mảng NumPy dựng sẵn từ EsgStore.
+    Thống kê theo ngành (trung bình, độ lệch chuẩn, percentile, z-score) được tính một lần khi load.
+    """
+
+    def __init__(self, store):
+        self.records = list(store)
+        n = len(self.records)
+        self.scores = np.full((n, len(PILLARS)), np.nan)
+        for i, record in enumerate(self.records):
+            for j, field in enumerate(PILLARS):
+                value = getattr(record, field)
+                if value is not None:
+                    self.scores[i, j] = value
+
+        industries = [record.industry or UNKNOWN_INDUSTRY for record in self.records]
+        self.industry_names, self.industry_codes = np.unique(np.array(industries, dtype=object), return_inverse=True)
+        self.industry_names = [str(name) for name in self.industry_names]
+        self._index = {record.name: i for i, record in enumerate(self.records)}
+        self._precompute()
+
+    def _precompute(self):
+        k = len(self.industry_names)
+        shape = (k, len(PILLARS))
+        self.industry_mean = np.full(shape, np.nan)
+        self.industry_std = np.full(shape, np.nan)
+        self.industry_count = np.zeros(shape, dtype=int)
+        self.percentiles = np.full(self.scores.shape, np.nan)
+
+        for code in range(k):
+            rows = np.flatnonzero(self.industry_codes == code)
+            group = self.scores[rows]
+            valid = ~np.isnan(group)
+            self.industry_count[code] = valid.sum(axis=0)
+            for j in range(len(PILLARS)):
+                values = group[valid[:, j], j]
+                if not len(values):
+                    continue
+                self.industry_mean[code, j] = values.mean()
+                self.industry_std[code, j] = values.std()
+                # Percentile trong ngành: % công ty cùng ngành có điểm <= điểm của công ty
+                ordered = np.sort(values)
+                self.percentiles[rows[valid[:, j]], j] = \
+                    np.searchsorted(ordered, values, side="right") / len(values) * 100
+
+        mean = self.industry_mean[self.industry_codes]
+        std = self.industry_std[self.industry_codes]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.zscores = np.where(std > 0, (self.scores - mean) / std, 0.0)
+        self.zscores[np.isnan(self.scores)] = np.nan
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def _value(x) -> Optional[float]:
+        return None if x is None or np.isnan(x) else round(float(x), 2)
+
+    def _row(self, i: int) -> Dict:
+        record = self.records[i]
+        code = self.industry_codes[i]
+        return {
+            "company": record.name,
+            "ticker": record.ticker,
+            "industry": record.industry,
+            "esg": record.esg_dict(),
+            "industry_percentile": {p: self._value(self.percentiles[i, j]) for j, p in enumerate(PILLARS)},
+            "industry_zscore": {p: self._value(self.zscores[i, j]) for j, p in enumerate(PILLARS)},
+            "industry_mean": {p: self._value(self.industry_mean[code, j]) for j, p in enumerate(PILLARS)},
+            "industry_size": int(self.industry_count[code, PILLARS.index("total_score")]),
+        }
+
+    def screen(self, industry: Optional[str] = None, min_scores: Optional[Dict[str, float]] = None,
+               max_scores: Optional[Dict[str, float]] = None, min_percentile: Optional[Dict[str, float]] = None,
+               sort_by: str = "total_score", relative: bool = False, ascending: bool = False,
+               top: int = 20) -> List[Dict]:
+        """
+        Lọc đa tiêu chí rồi lấy top-N theo một trụ cột (điểm tuyệt đối, hoặc z-score trong ngành nếu relative=True)
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        if industry:
+            names = [n.lower() for n in self.industry_names]
+            if industry.lower() not in names:
+                return []
+            mask &= self.industry_codes == names.index(industry.lower())
+        with np.errstate(invalid="ignore"):
+            for field, value in (min_scores or {}).items():
+                mask &= self.scores[:, PILLARS.index(field)] >= value
+            for field, value in (max_scores or {}).items():
+                mask &= self.scores[:, PILLARS.index(field)] <= value
+            for field, value in (min_percentile or {}).items():
+                mask &= self.percentiles[:, PILLARS.index(field)] >= value
+
+        column = (self.zscores if relative else self.scores)[:, PILLARS.index(sort_by)]
+        candidates = np.flatnonzero(mask & ~np.isnan(column))
+        order = np.argsort(column[candidates], kind="stable")
+        if not ascending:
+            order = order[::-1]
+        return [self._row(i) for i in candidates[order][:top]]
+
+    def compare(self, names: List[str]) -> List[Dict]:
+        rows = []
+        for name in names:
+            i = self._index.get(name)
+            if i is not None:
+                rows.append(self._row(i))
+        return rows
+
+    def industries(self) -> List[Dict]:
+        return [
+            {
+                "industry": name,
+                "companies": int(self.industry_count[code, PILLARS.index("total_score")]),
+                "mean": {p: self._value(self.industry_mean[code, j]) for j, p in enumerate(PILLARS)},
+                "std": {p: self._value(self.industry_std[code, j]) for j, p in enumerate(PILLARS)},
+            }
+            for code, name in enumerate(self.industry_names)
+        ]
+
+
+def comparison_markdown(rows: List[Dict]) -> str:
+    """Bảng so sánh dạng markdown cho câu trả lời /api/ask"""
+    header = "| Metric | " + " | ".join(r["company"] for r in rows) + " |"
+    divider = "|---" * (len(rows) + 1) + "|"
+    lines = [header, divider]
+    for pillar in PILLARS:
+        label = pillar.replace("_", " ").title()
+        cells = []
+        for r in rows:
+            score = r["esg"].get(pillar)
+            percentile = r["industry_percentile"][pillar]
+            cells.append("n/a" if score is None else f"{score} (P{percentile:.0f} in {r['industry'] or 'industry'})")
+        lines.append(f"| {label} | " + " | ".join(cells) + " |")
+    lines.append("| Total Grade | " + " | ".join(str(r["esg"].get("total_grade") or "n/a") for r in rows) + " |")
+
+    best = max(rows, key=lambda r: r["esg"].get("total_score") or 0)
+    return "\n".join(lines) + f"\n\n**Highest overall ESG score**: {best['company']}"
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+from coalesce import Coalescer
+from cache import company_scope
+
+T = TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS news (
+    query TEXT PRIMARY KEY,
+    articles TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS articles (
+    key TEXT PRIMARY KEY,
+    company TEXT NOT NULL,
+    url TEXT,
+    analysis TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_company_url ON articles (company, url);
+CREATE TABLE IF NOT EXISTS companies (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """
+    Kho kết quả dùng chung giữa các worker uvicorn (SQLite chế độ WAL trên đĩa cục bộ):
+    tin tức theo query, phân tích theo bài báo, kết quả theo công ty.
+    Kết quả còn lại sau khi deploy / khởi động lại, và lease trong bảng leases đảm bảo
+    mỗi công ty chỉ được một worker tính tại một thời điểm.
+    """
+
+    def __init__(self, path: str, lease_ttl: float = 120, poll_interval: float = 0.5):
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._inflight = Coalescer()
+        self.computed = 0
+        self.waited = 0
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        # Thread riêng cho các thao tác SQLite từ event loop: DB bị worker khác khóa (tối đa timeout=10s)
+        # chỉ làm chậm request đang chờ kho, không chặn cả event loop. Một thread là đủ vì kết nối
+        # đã được tuần tự hóa bằng _lock.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(articles)")]
+            if columns and "company" not in columns:
+                # Kho cũ lưu phân tích không kèm công ty (kết quả công ty có thể chứa phân tích của
+                # công ty khác): bỏ đi và tính lại
+                self._conn.execute("DROP TABLE articles")
+                self._conn.execute("DROP TABLE IF EXISTS companies")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+    async def call(self, method: Callable[..., T], *args) -> T:
+        """Chạy một phương thức đồng bộ của kho trên thread riêng, vd: await store.call(store.get_news, q, ttl)"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(method, *args))
+
+    def _fetchone(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    # ---- Tin tức ----
+
+    def get_news(self, query: str, max_age: float) -> Optional[List[Dict]]:
+        row = self._fetchone(
+            "SELECT articles FROM news WHERE query = ? AND stored_at >= ?", (query, time.time() - max_age)
+        )
+        return json.loads(row[0]) if row else None
+
+    def put_news(self, query: str, articles: List[Dict]):
+        self._execute(
+            "INSERT OR REPLACE INTO news (query, articles, stored_at) VALUES (?, ?, ?)",
+            (query, json.dumps(articles, ensure_ascii=False), time.time()),
+        )
+
+    # ---- Phân tích theo bài báo ----
+
+    def get_articles(self, keys: List[str], urls: List[str], company: str, max_age: float) -> Dict[str, str]:
+        """
+        Trả về {key: analysis} cho các bài đã có. Bài không khớp khóa (công ty + URL + nội dung) thì
+        thử khớp theo URL của cùng công ty, để dùng lại các bản dump cũ không lưu nội dung bài báo.
+        """
+        if not keys:
+            return {}
+        since = time.time() - max_age
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, analysis FROM articles WHERE key IN ({placeholders}) AND stored_at >= ?",
+                (*keys, since),
+            ).fetchall()
+            found = dict(rows)
+            missing = [(key, url) for key, url in zip(keys, urls) if key not in found and url]
+            if missing:
+                by_url = dict(self._conn.execute(
+                    f"SELECT url, analysis FROM articles WHERE company = ? "
+                    f"AND url IN ({','.join('?' * len(missing))}) AND stored_at >= ?",
+                    (company_scope(company), *(url for _, url in missing), since),
+                ).fetchall())
+                for key, url in missing:
+                    if url in by_url:
+                        found[key] = by_url[url]
+        return found
+
+    def put_articles(self, company: str, rows: Iterable[tuple]):
+        """rows: các bộ (key, url, analysis) của cùng một công ty"""
+        now = time.time()
+        scope = company_scope(company)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO articles (key, company, url, analysis, stored_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, scope, url, analysis, now) for key, url, analysis in rows],
+            )
+
+    # ---- Kết quả theo công ty ----
+
+    def get_company(self, key: str, max_age: float, newer_than: float = 0) -> Optional[Dict]:
+        row = self._fetchone(
+            "SELECT response FROM companies WHERE key = ? AND stored_at >= ?",
+            (key, max(time.time() - max_age, newer_than)),
+        )
+        return json.loads(row[0]) if row else None
+
+    def put_company(self, key: str, response: Dict):
+        self._execute(
+            "INSERT OR REPLACE INTO companies (key, response, stored_at) VALUES (?, ?, ?)",
+            (key, json.dumps(response, ensure_ascii=False), time.time()),
+        )
+
+    # ---- Lease giữa các process ----
+
+    def try_acquire(self, key: str) -> bool:
+        """Lấy lease nếu chưa ai giữ hoặc lease cũ đã hết hạn (worker giữ lease bị chết)"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+                (key, self.owner, now + self.lease_ttl, now),
+            )
+            return cursor.rowcount > 0
+
+    def renew(self, key: str):
+        self._execute(
+            "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (time.time() + self.lease_ttl, key, self.owner),
+        )
+
+    def release(self, key: str):
+        self._execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    async def _keep_lease(self, key: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            await self.call(self.renew, key)
+
+    async def single_flight(self, key: str, compute: Callable[[], Awaitable[T]],
+                            load: Callable[[], Awaitable[Optional[T]]]) -> T:
+        """
+        Chỉ một lời gọi compute() cho mỗi key trên toàn bộ các worker:
+        - trong cùng process, các request trùng chờ chung một task (request bị hủy không làm hủy request khác)
+        - giữa các process, ai giữ lease thì tính, các worker khác chờ rồi đọc kết quả bằng load()
+        """
+        return await self._inflight.run(key, lambda: self._single_flight(key, compute, load))
+
+    async def _single_flight(self, key: str, compute: Callable[[], Awaitable[T]],
+                             load: Callable[[], Awaitable[Optional[T]]]) -> T:
+        waited = False
+        while True:
+            result = await load()
+            if result is not None:
+                if waited:
+                    self.waited += 1
+                return result
+            if await self.call(self.try_acquire, key):
+                break
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+
+        keeper = asyncio.ensure_future(self._keep_lease(key))
+        try:
+            self.computed += 1
+            return await compute()
+        finally:
+            keeper.cancel()
+            await self.call(self.release, key)
+
+    async def run_exclusive(self, key: str, work: Callable[[], Awaitable[T]]) -> bool:
+        """
+        Chạy work() nếu giành được lease key (lease được gia hạn trong lúc chạy).
+        Worker khác đang giữ lease thì bỏ qua và trả về False.
+        """
+        if not await self.call(self.try_acquire, key):
+            return False
+        keeper = asyncio.ensure_future(self._keep_lease(key))
+        try:
+            await work()
+            return True
+        finally:
+            keeper.cancel()
+            await self.call(self.release, key)
+
+    # ---- Bảo trì ----
+
+    def warm_load(self, dump_path: str) -> int:
+        """
+        Nạp các bản dump cũ dạng {company: [{title, url, analysis}]} (vd esg_analysis.json)
+        vào bảng articles theo từng công ty của dump, bài đã có trong kho thì giữ nguyên.
+        """
+        try:
+            with open(dump_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Failed to read {dump_path}: {e}")
+            return 0
+
+        # Tính hạn từ lúc nạp vào kho (phân tích một bài báo không cũ đi theo thời gian)
+        stored_at = time.time()
+        rows = [
+            (f"url:{company_scope(company)}:{item['url']}", company_scope(company), item["url"], item["analysis"],
+             stored_at)
+            for company, items in data.items() if isinstance(items, list)
+            for item in items
+            if isinstance(item, dict) and item.get("url") and item.get("analysis")
+            and not item["analysis"].startswith("Gemini Analysis Failed")
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles (key, company, url, analysis, stored_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            return self._conn.total_changes - before
+
+    def prune(self, max_ages: Dict[str, float]):
+        """Xóa bản ghi quá hạn, max_ages: {tên bảng: số giây}"""
+        now = time.time()
+        with self._lock:
+            for table in ("news", "articles", "companies"):
+                if table in max_ages:
+                    self._conn.execute(f"DELETE FROM {table} WHERE stored_at < ?", (now - max_ages[table],))
+            self._conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("news", "articles", "companies", "leases")
+            }
+        return {"path": self.path, "owner": self.owner, "computed": self.computed, "waited": self.waited, **counts}
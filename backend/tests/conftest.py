@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module backend được import trực tiếp theo tên (như khi chạy uvicorn main:app trong backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+import analysis_engine
+from analysis_engine import AnalysisEngine, TokenBucket, is_quota_error
+from benchmark import FakeGeminiModel, QuotaExceeded
+
+
+class FlakyModel(FakeGeminiModel):
+    """Lỗi quota ở failures lần gọi đầu, sau đó trả lời bình thường"""
+
+    def __init__(self, failures: int):
+        super().__init__(latency=0)
+        self.failures = failures
+
+    def generate(self, prompt: str) -> str:
+        if self.calls < self.failures:
+            self.calls += 1
+            raise QuotaExceeded("429 Resource has been exhausted (e.g. check quota).")
+        return super().generate(prompt)
+
+
+def make_engine(model, **kwargs) -> AnalysisEngine:
+    kwargs = {"requests_per_minute": 1e6, "tokens_per_minute": 1e9, "base_delay": 0.001, "max_delay": 0.01,
+              **kwargs}
+    return AnalysisEngine(model, **kwargs)
+
+
+def test_quota_error_is_retried_with_backoff(monkeypatch):
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(analysis_engine.asyncio, "sleep", fake_sleep)
+    model = FlakyModel(failures=2)
+    engine = make_engine(model, base_delay=1.0, max_delay=60.0)
+
+    assert asyncio.run(engine.generate("Summary please")).startswith("Summary:")
+    assert model.calls == 3
+    # Backoff lũy thừa có jitter: lần thứ n chờ trong khoảng [d/2, d] với d = base_delay * 2^n
+    assert len(delays) == 2
+    assert 0.5 <= delays[0] <= 1.0
+    assert 1.0 <= delays[1] <= 2.0
+
+
+def test_quota_error_gives_up_after_max_retries():
+    model = FakeGeminiModel(latency=0, quota_rate=1.0)
+    engine = make_engine(model, max_retries=2)
+
+    with pytest.raises(QuotaExceeded):
+        asyncio.run(engine.generate("prompt"))
+    assert model.calls == 3
+
+
+def test_other_errors_are_not_retried():
+    model = FakeGeminiModel(latency=0, error_rate=1.0)
+    engine = make_engine(model)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(engine.generate("prompt"))
+    assert model.calls == 1
+
+
+def test_is_quota_error():
+    assert is_quota_error(QuotaExceeded("429 Resource has been exhausted"))
+    assert is_quota_error(RuntimeError("You exceeded your current quota"))
+    assert not is_quota_error(RuntimeError("500 Internal error"))
+
+
+def test_token_bucket_delay_accounting(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(analysis_engine.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(per_minute=60)  # 1 token / giây, sức chứa 60
+
+    assert bucket.reserve(60) == 0.0
+    # Bucket đã cạn: các lượt đặt trước xếp hàng nối tiếp nhau
+    assert bucket.reserve(30) == pytest.approx(30.0)
+    assert bucket.reserve(30) == pytest.approx(60.0)
+
+    # Sau 60 giây khoản nợ 60 token vừa được trả hết, lượt tiếp theo chờ 1 giây
+    now[0] += 60
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_token_bucket_clamps_oversized_requests(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(analysis_engine.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(per_minute=60)
+
+    # Yêu cầu lớn hơn sức chứa chỉ trừ tối đa bằng sức chứa, không chờ vô hạn
+    assert bucket.reserve(10_000) == 0.0
+    assert bucket.reserve(60) == pytest.approx(60.0)
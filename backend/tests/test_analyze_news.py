@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+import analyze_news
+from analysis_engine import AnalysisEngine
+from benchmark import FakeGeminiModel
+
+
+class RecordingModel(FakeGeminiModel):
+    """Model giả lập ghi lại các prompt đã nhận"""
+
+    def __init__(self, response=None):
+        super().__init__(latency=0)
+        self.prompts = []
+        self.response = response
+
+    def generate(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return self.response(prompt) if self.response else super().generate(prompt)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = RecordingModel()
+    monkeypatch.setattr(analyze_news, "engine", AnalysisEngine(
+        model, requests_per_minute=1e6, tokens_per_minute=1e9, base_delay=0.001,
+    ))
+    analyze_news.summary_cache.clear()
+    yield model
+    analyze_news.summary_cache.clear()
+
+
+def test_split_batch_response_marks_missing_parts():
+    text = "### ARTICLE 1\nfirst analysis\n\n**ARTICLE 3**\nthird analysis\n"
+    assert analyze_news._split_batch_response(text, 3) == ["first analysis", None, "third analysis"]
+
+
+def test_batch_falls_back_to_single_prompts_for_missing_parts(model, monkeypatch):
+    monkeypatch.setattr(analyze_news, "GEMINI_BATCH_SIZE", 3)
+
+    def respond(prompt):
+        if "(batch)" in prompt:
+            # Model bỏ sót bài thứ 2 trong câu trả lời gộp
+            return "### ARTICLE 1\nbatched one\n### ARTICLE 3\nbatched three"
+        return "single " + prompt.split("Article Title: ")[1].split()[0]
+
+    model.response = respond
+    items = [("one", "short content"), ("two", "short content"), ("three", "short content")]
+    results = asyncio.run(analyze_news.analyze_articles(items, "Tesla Inc"))
+
+    assert results == ["batched one", "single two", "batched three"]
+    assert sum("(batch)" in p for p in model.prompts) == 1
+    assert len(model.prompts) == 2
+
+
+def test_long_articles_are_not_batched(model, monkeypatch):
+    monkeypatch.setattr(analyze_news, "GEMINI_BATCH_SIZE", 3)
+    items = [("one", "x" * (analyze_news.GEMINI_BATCH_MAX_CHARS + 1)), ("two", "short")]
+
+    asyncio.run(analyze_news.analyze_articles(items, "Tesla Inc"))
+    assert not any("(batch)" in p for p in model.prompts)
+    assert len(model.prompts) == 2
+
+
+def test_summary_is_incremental_and_sends_only_new_analyses(model):
+    first = ["analysis A about emissions", "analysis B about labor"]
+    summary = asyncio.run(analyze_news.summarize_overall("Tesla Inc", first))
+    assert summary.startswith("Overall Sentiment")
+    assert len(model.prompts) == 1
+
+    # Cùng tập bài phân tích: trả bản tóm tắt đã cache, không gọi model
+    assert asyncio.run(analyze_news.summarize_overall("Tesla Inc", list(reversed(first)))) == summary
+    assert len(model.prompts) == 1
+
+    # Có bài mới: chỉ gửi phần chênh lệch cùng bản tóm tắt cũ
+    asyncio.run(analyze_news.summarize_overall("Tesla Inc", first + ["analysis C about governance"]))
+    assert len(model.prompts) == 2
+    update = model.prompts[-1]
+    assert "(update)" in update
+    assert "analysis C about governance" in update
+    assert "analysis A about emissions" not in update
+
+
+def test_map_reduce_splits_analyses_over_budget(model, monkeypatch):
+    monkeypatch.setattr(analyze_news, "SUMMARY_TOKEN_BUDGET", 100)
+    model.response = lambda prompt: "short partial" if "(partial)" in prompt else "Overall Sentiment: neutral"
+    analyses = [f"analysis {i} " + "x" * 300 for i in range(4)]  # ~78 token mỗi bài, mỗi nhóm một bài
+
+    asyncio.run(analyze_news.summarize_overall("Tesla Inc", analyses))
+    assert sum("(partial)" in p for p in model.prompts) == 4
+    # Các bản tóm tắt trung gian vừa một prompt: một lời gọi tóm tắt cuối
+    assert len(model.prompts) == 5
+    assert "short partial\n\nshort partial" in model.prompts[-1]
+
+
+def test_map_reduce_is_bounded_when_partials_do_not_shrink(model, monkeypatch):
+    # Regression: bản tóm tắt trung gian lớn hơn nửa ngân sách từng làm vòng reduce lặp vô hạn
+    monkeypatch.setattr(analyze_news, "SUMMARY_TOKEN_BUDGET", 2000)
+    model.response = lambda prompt: "x" * 4800  # ~1200 token cho mọi câu trả lời
+    analyses = [f"analysis {i} " + "a" * 3000 for i in range(20)]
+
+    asyncio.run(asyncio.wait_for(analyze_news.summarize_overall("Tesla Inc", analyses), timeout=10))
+    first_round = len(analyze_news._chunk_by_budget(analyses, 2000))
+    assert len(model.prompts) <= first_round * analyze_news.SUMMARY_MAX_REDUCE_ROUNDS + 1
+
+    # Đường cập nhật cũng phải dừng, kể cả khi bản tóm tắt cũ gần bằng ngân sách
+    model.prompts.clear()
+    more = [f"new analysis {i} " + "b" * 3000 for i in range(20)]
+    asyncio.run(asyncio.wait_for(analyze_news.summarize_overall("Tesla Inc", analyses + more), timeout=10))
+    assert 0 < len(model.prompts) <= first_round * analyze_news.SUMMARY_MAX_REDUCE_ROUNDS + 1
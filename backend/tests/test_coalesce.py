@@ -0,0 +1,112 @@
+import asyncio
+import httpx
+import pytest
+from coalesce import Coalescer
+from fetch_news import NewsClient
+from shared_store import SharedStore
+
+
+def test_cancelled_leader_does_not_fail_followers():
+    async def scenario():
+        coalescer = Coalescer()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.ensure_future(coalescer.run("key", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.run("key", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == "result"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert len(calls) == 1
+        assert len(coalescer) == 0
+
+    asyncio.run(scenario())
+
+
+def test_shared_call_is_cancelled_when_no_waiter_is_left():
+    async def scenario():
+        coalescer = Coalescer()
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(coalescer.run("key", upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        assert "key" not in coalescer
+
+        # Lời gọi sau đó bắt đầu một lượt mới, không nhận task đã bị hủy
+        async def fresh():
+            return "fresh"
+        assert await coalescer.run("key", fresh) == "fresh"
+
+    asyncio.run(scenario())
+
+
+def test_news_client_follower_survives_leader_cancellation():
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"articles": [
+            {"title": "t", "url": "https://example.com/a", "source": {"name": "s"}, "content": "c"},
+        ]})
+
+    async def scenario():
+        client = NewsClient(transport=httpx.MockTransport(handler))
+        try:
+            leader = asyncio.ensure_future(client.fetch("Tesla Inc", 5))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(client.fetch("Tesla Inc", 5))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+
+            articles = await follower
+            assert [a["url"] for a in articles] == ["https://example.com/a"]
+            assert client.upstream_calls == 1
+            assert client.coalesced_calls == 1
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_shared_store_follower_survives_leader_cancellation(tmp_path):
+    async def scenario(store):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def load():
+            return None
+
+        leader = asyncio.ensure_future(store.single_flight("company:tesla", compute, load))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(store.single_flight("company:tesla", compute, load))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == "result"
+        assert len(calls) == 1
+
+    store = SharedStore(str(tmp_path / "shared.db"))
+    try:
+        asyncio.run(scenario(store))
+    finally:
+        store.close()
@@ -0,0 +1,208 @@
+import asyncio
+import pytest
+from analysis_engine import AnalysisEngine
+from benchmark import FakeGeminiModel
+from work_scheduler import (
+    WorkScheduler, Priority, PrioritySemaphore, QueueFullError, DeadlineExceeded, ClientDisconnected,
+    cancel_on_disconnect,
+)
+
+
+async def hold(event: asyncio.Event):
+    await event.wait()
+
+
+def test_cancelled_queued_waiter_returns_its_slot():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1)
+        await scheduler._acquire(Priority.BULK)
+        waiter = asyncio.ensure_future(scheduler._acquire(Priority.BULK))
+        await asyncio.sleep(0)
+
+        # Chỗ được cấp cho waiter nhưng waiter bị hủy trước khi kịp chạy
+        scheduler._release(Priority.BULK)
+        assert scheduler.active[Priority.BULK] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.active[Priority.BULK] == 0
+        assert scheduler.queued[Priority.BULK] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_run_while_queued_does_not_leak():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1)
+        release = asyncio.Event()
+        running = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: hold(release)))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: hold(release)))
+        await asyncio.sleep(0)
+        assert scheduler.queued[Priority.BULK] == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        release.set()
+        await running
+
+        assert scheduler.active[Priority.BULK] == 0
+        assert scheduler.queued[Priority.BULK] == 0
+        assert scheduler.cancelled[Priority.BULK] == 1
+        # Chỗ trống được dùng lại ngay
+        assert await asyncio.wait_for(scheduler.run(Priority.BULK, lambda: asyncio.sleep(0, "ok")), 1) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_deadline_while_queued_raises_and_does_not_leak_a_slot():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1)
+        release = asyncio.Event()
+        running = asyncio.ensure_future(scheduler.run(Priority.EXPLICIT, lambda: hold(release)))
+        await asyncio.sleep(0)
+
+        with pytest.raises(DeadlineExceeded, match="queued"):
+            await scheduler.run(Priority.EXPLICIT, lambda: asyncio.sleep(0), timeout=0.05)
+        assert scheduler.timeouts[Priority.EXPLICIT] == 1
+        assert scheduler.queued[Priority.EXPLICIT] == 0
+
+        release.set()
+        await running
+        assert scheduler.active[Priority.EXPLICIT] == 0
+
+    asyncio.run(scenario())
+
+
+def test_deadline_while_running_raises():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1)
+        with pytest.raises(DeadlineExceeded, match="running"):
+            await scheduler.run(Priority.INTERACTIVE, lambda: asyncio.sleep(1), timeout=0.02)
+        assert scheduler.active[Priority.INTERACTIVE] == 0
+
+    asyncio.run(scenario())
+
+
+def test_interactive_is_admitted_before_queued_bulk():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1)
+        release = asyncio.Event()
+        order = []
+
+        async def record(name):
+            order.append(name)
+
+        running = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: hold(release)))
+        await asyncio.sleep(0)
+        bulk = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: record("bulk")))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(scheduler.run(Priority.INTERACTIVE, lambda: record("interactive")))
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(running, bulk, interactive)
+        assert order == ["interactive", "bulk"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        scheduler = WorkScheduler(max_concurrency=1, queue_limits={Priority.BULK: 1})
+        release = asyncio.Event()
+        running = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: hold(release)))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(scheduler.run(Priority.BULK, lambda: hold(release)))
+        await asyncio.sleep(0)
+
+        with pytest.raises(QueueFullError):
+            await scheduler.run(Priority.BULK, lambda: hold(release))
+        with pytest.raises(QueueFullError):
+            scheduler.ensure_capacity(Priority.BULK, 2)
+        assert scheduler.rejected[Priority.BULK] == 3
+
+        release.set()
+        await asyncio.gather(running, queued)
+
+    asyncio.run(scenario())
+
+
+def test_priority_semaphore_grants_interactive_first_and_skips_cancelled_waiters():
+    async def scenario():
+        semaphore = PrioritySemaphore(1)
+        order = []
+
+        async def take(name, priority):
+            async with semaphore.hold(priority):
+                order.append(name)
+
+        await semaphore.acquire(Priority.BULK)
+        tasks = [
+            asyncio.ensure_future(take("bulk", Priority.BULK)),
+            asyncio.ensure_future(take("cancelled", Priority.INTERACTIVE)),
+            asyncio.ensure_future(take("explicit", Priority.EXPLICIT)),
+            asyncio.ensure_future(take("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        semaphore.release()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert order == ["interactive", "explicit", "bulk"]
+        # Không mất chỗ nào: lấy lại ngay được
+        await asyncio.wait_for(semaphore.acquire(Priority.BULK), 1)
+
+    asyncio.run(scenario())
+
+
+class OrderedModel(FakeGeminiModel):
+    def __init__(self):
+        super().__init__(latency=0.02)
+        self.order = []
+
+    def generate(self, prompt: str) -> str:
+        self.order.append(prompt)
+        return super().generate(prompt)
+
+
+def test_interactive_gemini_call_overtakes_queued_bulk_calls():
+    async def scenario():
+        model = OrderedModel()
+        engine = AnalysisEngine(model, max_concurrency=1, requests_per_minute=1e6, tokens_per_minute=1e9)
+        scheduler = WorkScheduler(max_concurrency=8)
+
+        async def bulk_company():
+            await asyncio.gather(*(engine.generate(f"bulk {i}") for i in range(5)))
+
+        bulk = asyncio.ensure_future(scheduler.run(Priority.BULK, bulk_company))
+        await asyncio.sleep(0.005)
+        await scheduler.run(Priority.INTERACTIVE, lambda: engine.generate("interactive"))
+        await bulk
+
+        # Chỉ lời gọi bulk đang chạy (và có thể một lời gọi vừa được cấp chỗ) đứng trước
+        assert model.order.index("interactive") <= 2
+
+    asyncio.run(scenario())
+
+
+def test_cancel_on_disconnect_cancels_work():
+    async def scenario():
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def is_disconnected():
+            return True
+
+        with pytest.raises(ClientDisconnected):
+            await cancel_on_disconnect(is_disconnected, work(), poll_interval=0.01)
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(scenario())
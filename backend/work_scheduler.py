@@ -0,0 +1,215 @@
+import heapq
+import asyncio
+import itertools
+import contextlib
+from contextvars import ContextVar
+from collections import Counter, deque
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # /api/ask
+    EXPLICIT = 1     # /api/analyze_companies
+    BULK = 2         # default list, stream, precompute
+
+
+# Lớp ưu tiên của công việc đang chạy, WorkScheduler.run đặt giá trị này để các tầng bên dưới
+# (vd: semaphore Gemini trong AnalysisEngine) xếp hàng theo cùng thứ tự ưu tiên
+current_priority: ContextVar[Optional[Priority]] = ContextVar("current_priority", default=None)
+
+
+class QueueFullError(Exception):
+    """Hàng đợi của lớp ưu tiên đã đầy -> trả 429 cho client"""
+
+
+class DeadlineExceeded(Exception):
+    """Công việc không hoàn thành (hoặc chưa được chạy) trước deadline của request"""
+
+
+class ClientDisconnected(Exception):
+    """Client đã ngắt kết nối, công việc đang chờ / đang chạy bị hủy"""
+
+
+class WorkScheduler:
+    """
+    Điều phối công việc LLM / tin tức theo lớp ưu tiên:
+    - tối đa max_concurrency công việc chạy cùng lúc, mỗi lớp có giới hạn riêng
+      (để bulk không chiếm hết chỗ của người dùng tương tác)
+    - mỗi lớp có hàng đợi giới hạn, đầy thì từ chối ngay (QueueFullError)
+    - khi có chỗ trống, công việc ở lớp ưu tiên cao hơn được chạy trước
+    """
+
+    def __init__(self, max_concurrency: int = 8, class_concurrency: Optional[Dict[Priority, int]] = None,
+                 queue_limits: Optional[Dict[Priority, int]] = None):
+        self.max_concurrency = max_concurrency
+        self.class_concurrency = {p: max_concurrency for p in Priority}
+        self.class_concurrency.update(class_concurrency or {})
+        self.queue_limits = {Priority.INTERACTIVE: 100, Priority.EXPLICIT: 200, Priority.BULK: 2000}
+        self.queue_limits.update(queue_limits or {})
+        self._waiters: Dict[Priority, deque] = {p: deque() for p in Priority}
+        self.active: Counter = Counter()
+        self.queued: Counter = Counter()
+        self.completed: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.timeouts: Counter = Counter()
+        self.cancelled: Counter = Counter()
+
+    def _can_run(self, priority: Priority) -> bool:
+        return sum(self.active.values()) < self.max_concurrency and \
+            self.active[priority] < self.class_concurrency[priority]
+
+    def _dispatch(self):
+        for priority in Priority:
+            waiters = self._waiters[priority]
+            while waiters and self._can_run(priority):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self.active[priority] += 1
+                future.set_result(None)
+
+    def _release(self, priority: Priority):
+        self.active[priority] -= 1
+        self._dispatch()
+
+    def ensure_capacity(self, priority: Priority, count: int = 1):
+        """Kiểm tra trước cho một lô công việc: từ chối cả lô nếu hàng đợi không đủ chỗ"""
+        if self.queued[priority] + count > self.queue_limits[priority] + self.max_concurrency:
+            self.rejected[priority] += count
+            raise QueueFullError(f"{priority.name.lower()} queue is full")
+
+    async def _acquire(self, priority: Priority):
+        higher_waiting = any(self._waiters[p] for p in Priority if p <= priority)
+        if self._can_run(priority) and not higher_waiting:
+            self.active[priority] += 1
+            return
+        if self.queued[priority] >= self.queue_limits[priority]:
+            self.rejected[priority] += 1
+            raise QueueFullError(f"{priority.name.lower()} queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        self.queued[priority] += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Đã được cấp chỗ nhưng bị hủy ngay sau đó: trả lại chỗ
+            if future.done() and not future.cancelled():
+                self._release(priority)
+            raise
+        finally:
+            self.queued[priority] -= 1
+
+    async def run(self, priority: Priority, factory: Callable[[], Awaitable[T]],
+                  timeout: Optional[float] = None) -> T:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        try:
+            await asyncio.wait_for(self._acquire(priority), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[priority] += 1
+            raise DeadlineExceeded(f"deadline exceeded while queued ({priority.name.lower()})")
+        except asyncio.CancelledError:
+            self.cancelled[priority] += 1
+            raise
+
+        token = current_priority.set(priority)
+        try:
+            remaining = max(0.0, deadline - loop.time()) if deadline is not None else None
+            result = await asyncio.wait_for(factory(), remaining)
+            self.completed[priority] += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts[priority] += 1
+            raise DeadlineExceeded(f"deadline exceeded while running ({priority.name.lower()})")
+        except asyncio.CancelledError:
+            self.cancelled[priority] += 1
+            raise
+        finally:
+            current_priority.reset(token)
+            self._release(priority)
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "classes": {
+                priority.name.lower(): {
+                    "active": self.active[priority],
+                    "queued": self.queued[priority],
+                    "max_active": self.class_concurrency[priority],
+                    "queue_limit": self.queue_limits[priority],
+                    "completed": self.completed[priority],
+                    "rejected": self.rejected[priority],
+                    "timeouts": self.timeouts[priority],
+                    "cancelled": self.cancelled[priority],
+                }
+                for priority in Priority
+            },
+        }
+
+
+class PrioritySemaphore:
+    """
+    Semaphore cấp chỗ theo lớp ưu tiên (INTERACTIVE trước BULK), cùng lớp thì theo thứ tự đến
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: List[tuple] = []  # heap (priority, seq, future)
+        self._seq = itertools.count()
+
+    def _wake(self):
+        while self._waiters and self._value > 0:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._value -= 1
+            future.set_result(None)
+
+    async def acquire(self, priority: Priority):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Đã được cấp chỗ nhưng bị hủy ngay sau đó: trả lại chỗ
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self._value += 1
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, priority: Priority):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+async def cancel_on_disconnect(is_disconnected: Callable[[], Awaitable[bool]], awaitable: Awaitable[T],
+                               poll_interval: float = 0.5) -> T:
+    """
+    Chạy awaitable, định kỳ kiểm tra client còn kết nối không; nếu client đã ngắt
+    thì hủy công việc (cả phần đang chờ trong hàng đợi lẫn đang chạy).
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()